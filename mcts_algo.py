@@ -1,33 +1,316 @@
+import math
+import os
+import sys
+from array import array
+
 import numpy as np
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "new"))
+
+import bitboard
+import heuristics
+import profiling
+from game_functions import is_packable, move_down, move_left, move_right, move_up
+from random_stream import default_stream
+
+NUMBER_OF_MOVES = 4
+EXPLORATION = 1.4
+WIDENING_COEFFICIENT = 1.0
+WIDENING_EXPONENT = 0.5
+ROLLOUT_LENGTH = 10
+MAX_NODES = 1 << 20
+SELECTIONS = ("ucb1", "puct")
+LEAVES = ("rollout", "evaluator")
+NO_NODE = -1
+
+
+class NodePool:
+    # Decision nodes are positions with the player to move. Expanding one
+    # allocates four consecutive chance nodes, one afterstate per move; a
+    # chance node's spawn outcomes are decision nodes chained via next_sibling.
+    def __init__(self):
+        self.board = array("Q")
+        self.visits = array("q")
+        self.first_chance = array("q")
+        self.probability = array("d")
+        self.next_sibling = array("q")
+
+        self.afterstate = array("Q")
+        self.reward = array("d")
+        self.legal = array("b")
+        self.chance_visits = array("q")
+        self.value_sum = array("d")
+        self.first_child = array("q")
+        self.child_count = array("q")
+
+    def __len__(self):
+        return len(self.board)
+
+    def add_decision(self, board, probability):
+        self.board.append(board)
+        self.visits.append(0)
+        self.first_chance.append(NO_NODE)
+        self.probability.append(probability)
+        self.next_sibling.append(NO_NODE)
+        return len(self.board) - 1
+
+    def expand(self, node):
+        self.first_chance[node] = len(self.afterstate)
+        board = self.board[node]
+        for move in bitboard.MOVES:
+            new_board, move_made, score = move(board)
+            self.afterstate.append(new_board)
+            self.reward.append(score)
+            self.legal.append(move_made)
+            self.chance_visits.append(0)
+            self.value_sum.append(0.0)
+            self.first_child.append(NO_NODE)
+            self.child_count.append(0)
+
+    def find_child(self, chance, board):
+        child = self.first_child[chance]
+        while child != NO_NODE and self.board[child] != board:
+            child = self.next_sibling[child]
+        return child
+
+    def add_child(self, chance, board, probability):
+        child = self.add_decision(board, probability)
+        self.next_sibling[child] = self.first_child[chance]
+        self.first_child[chance] = child
+        self.child_count[chance] += 1
+        return child
+
+
+class MCTS:
+    def __init__(self, exploration=EXPLORATION, selection="ucb1", leaf="rollout",
+                 rollout_length=ROLLOUT_LENGTH, evaluator=None,
+                 widening_coefficient=WIDENING_COEFFICIENT, widening_exponent=WIDENING_EXPONENT,
+                 max_nodes=MAX_NODES, rng=None):
+        if selection not in SELECTIONS:
+            raise ValueError(f"selection must be one of {SELECTIONS}")
+        if leaf not in LEAVES:
+            raise ValueError(f"leaf must be one of {LEAVES}")
+        if leaf == "evaluator" and evaluator is None:
+            evaluator = heuristics.default_evaluator()
+        self.exploration = exploration
+        self.selection = selection
+        self.leaf = leaf
+        self.rollout_length = rollout_length
+        self.evaluator = evaluator
+        # Rollout leaves score collected merges, so a lost board is worth 0.
+        self.game_over_value = heuristics.game_over_value(evaluator) if leaf == "evaluator" else 0.0
+        self.widening_coefficient = widening_coefficient
+        self.widening_exponent = widening_exponent
+        self.max_nodes = max_nodes
+        self.rng = default_stream() if rng is None else rng
+        self.pool = NodePool()
+        self.root = NO_NODE
+        self.last_move = None
+        self.reused_visits = 0
+
+    def reset(self, board):
+        self.pool = NodePool()
+        self.root = self.pool.add_decision(board, 1.0)
+        self.last_move = None
+
+    def set_root(self, board):
+        # Reuse the subtree reached by the last chosen move and this spawn.
+        pool = self.pool
+        self.reused_visits = 0
+        if self.root != NO_NODE and pool.board[self.root] == board:
+            self.reused_visits = pool.visits[self.root]
+            return
+        if self.root != NO_NODE and self.last_move is not None \
+                and pool.first_chance[self.root] != NO_NODE:
+            child = pool.find_child(pool.first_chance[self.root] + self.last_move, board)
+            if child != NO_NODE:
+                self.reused_visits = pool.visits[child]
+                self.root = child
+                if len(pool) > self.max_nodes:
+                    self.compact()
+                self.last_move = None
+                return
+        self.reset(board)
+
+    def compact(self):
+        old = self.pool
+        new = NodePool()
+        new_root = new.add_decision(old.board[self.root], 1.0)
+        pending = [(new_root, self.root)]
+        while pending:
+            new_node, old_node = pending.pop()
+            new.visits[new_node] = old.visits[old_node]
+            old_first = old.first_chance[old_node]
+            if old_first == NO_NODE:
+                continue
+            new.first_chance[new_node] = len(new.afterstate)
+            for move_index in range(NUMBER_OF_MOVES):
+                old_chance = old_first + move_index
+                new.afterstate.append(old.afterstate[old_chance])
+                new.reward.append(old.reward[old_chance])
+                new.legal.append(old.legal[old_chance])
+                new.chance_visits.append(old.chance_visits[old_chance])
+                new.value_sum.append(old.value_sum[old_chance])
+                new.first_child.append(NO_NODE)
+                new.child_count.append(0)
+            for move_index in range(NUMBER_OF_MOVES):
+                old_chance = old_first + move_index
+                new_chance = new.first_chance[new_node] + move_index
+                old_child = old.first_child[old_chance]
+                while old_child != NO_NODE:
+                    new_child = new.add_child(new_chance, old.board[old_child],
+                                              old.probability[old_child])
+                    pending.append((new_child, old_child))
+                    old_child = old.next_sibling[old_child]
+        self.pool = new
+        self.root = new_root
+
+    def search(self, board, iterations):
+        self.set_root(board)
+        for _ in range(iterations):
+            self.simulate()
+        profiling.add_work(nodes=iterations, rollouts=iterations if self.leaf == "rollout" else 0)
+        return self.best_move()
+
+    def best_move(self):
+        pool = self.pool
+        first = pool.first_chance[self.root]
+        if first == NO_NODE:
+            return None
+        best_index = None
+        for move_index in range(NUMBER_OF_MOVES):
+            chance = first + move_index
+            if pool.legal[chance] and (best_index is None or pool.chance_visits[chance]
+                                       > pool.chance_visits[first + best_index]):
+                best_index = move_index
+        self.last_move = best_index
+        return best_index
+
+    def move_visits(self):
+        pool = self.pool
+        first = pool.first_chance[self.root]
+        if first == NO_NODE:
+            return [0] * NUMBER_OF_MOVES
+        return [pool.chance_visits[first + move_index] for move_index in range(NUMBER_OF_MOVES)]
+
+    def simulate(self):
+        pool = self.pool
+        node = self.root
+        path = []
+        while True:
+            if pool.visits[node] == 0:
+                pool.visits[node] = 1
+                value = self.leaf_value(pool.board[node])
+                break
+            if pool.first_chance[node] == NO_NODE:
+                pool.expand(node)
+            pool.visits[node] += 1
+            chance = self.select(node)
+            if chance is None:
+                value = self.game_over_value
+                break
+            path.append(chance)
+            node = self.spawn_child(chance)
+        for chance in reversed(path):
+            value += pool.reward[chance]
+            pool.chance_visits[chance] += 1
+            pool.value_sum[chance] += value
+
+    def select(self, node):
+        pool = self.pool
+        first = pool.first_chance[node]
+        chances = [first + move_index for move_index in range(NUMBER_OF_MOVES)
+                   if pool.legal[first + move_index]]
+        if not chances:
+            return None
+        means = {}
+        for chance in chances:
+            if pool.chance_visits[chance]:
+                means[chance] = pool.value_sum[chance] / pool.chance_visits[chance]
+            elif self.selection == "ucb1":
+                return chance
+        low = min(means.values(), default=0.0)
+        spread = max(means.values(), default=0.0) - low or 1.0
+        parent_visits = pool.visits[node]
+        prior = 1.0 / len(chances)
+        best = None
+        best_score = -math.inf
+        for chance in chances:
+            visits = pool.chance_visits[chance]
+            quality = (means[chance] - low) / spread if visits else 0.0
+            if self.selection == "ucb1":
+                bonus = math.sqrt(math.log(parent_visits) / visits)
+            else:
+                bonus = prior * math.sqrt(parent_visits) / (1 + visits)
+            score = quality + self.exploration * bonus
+            if score > best_score:
+                best = chance
+                best_score = score
+        return best
+
+    def spawn_child(self, chance):
+        # Progressive widening: new spawn outcomes are admitted only while the
+        # child count is below coefficient * visits ** exponent.
+        pool = self.pool
+        afterstate = pool.afterstate[chance]
+        board, probability = self.sample_spawn(afterstate)
+        child = pool.find_child(chance, board)
+        if child != NO_NODE:
+            return child
+        allowed = math.ceil(self.widening_coefficient
+                            * (pool.chance_visits[chance] + 1) ** self.widening_exponent)
+        if pool.child_count[chance] < allowed:
+            return pool.add_child(chance, board, probability)
+        return self.sample_existing_child(chance)
+
+    def sample_spawn(self, board):
+        cells = bitboard.empty_cells(board)
+        draw = self.rng.random()
+        cell = int(draw * len(cells))
+        exponent, tile_probability = bitboard.TILE_PROBABILITIES[
+            0 if draw * len(cells) - cell < bitboard.TILE_PROBABILITIES[0][1] else 1]
+        spawned = board | (exponent << (bitboard.CELL_BITS * cells[cell]))
+        return spawned, tile_probability / len(cells)
+
+    def sample_existing_child(self, chance):
+        pool = self.pool
+        total = 0.0
+        child = pool.first_child[chance]
+        while child != NO_NODE:
+            total += pool.probability[child]
+            child = pool.next_sibling[child]
+        target = self.rng.random() * total
+        child = pool.first_child[chance]
+        while True:
+            target -= pool.probability[child]
+            if target <= 0 or pool.next_sibling[child] == NO_NODE:
+                return child
+            child = pool.next_sibling[child]
+
+    def leaf_value(self, board):
+        if not bitboard.legal_moves(board):
+            return self.game_over_value
+        if self.leaf == "evaluator":
+            return self.evaluator(board)
+        total = 0.0
+        for _ in range(self.rollout_length):
+            board, move_made, score = bitboard.random_move(board, self.rng)
+            if not move_made:
+                break
+            total += score
+            board = bitboard.add_new_tile(board, self.rng)
+        return total
+
 
-def ai_move(board, searches_per_move, search_length):
-    first_moves = [move_down, move_left, move_right, move_up]
-    scores = np.zeros(4)
-
-    for first_index in range(4):
-        first_move = first_moves[first_index]
-        first_board, first_valid, first_score = first_move(board)
-
-        if first_valid:
-            first_board = add_new_tile(first_board)
-            scores[first_index] += first_score
-        else:
-            continue
-
-        for later_moves in range(searches_per_move):
-            move_number = 1
-            search_board = np.copy(first_board)
-            is_valid = True
-
-            while is_valid and move_number <= searches_per_move:
-                search_board, is_valid, score = random_move(search_board)
-                if is_valid:
-                    search_board = add_new_tile(search_board)
-                    scores[first_index] += score
-                    move_number += 1
-
-    best_move_index = np.argmax(scores)
-    best_move = first_moves[best_move_index]
-    final_board, position_valid = best_move(board)
-    return final_board, position_valid
\ No newline at end of file
+def ai_move(board, searches_per_move, search_length, searcher=None):
+    if not is_packable(board):
+        raise ValueError(f"MCTS only searches 4x4 boards with tiles below "
+                         f"{1 << bitboard.MAX_EXPONENT}, got shape {np.shape(board)}")
+    if searcher is None:
+        searcher = MCTS(rollout_length=search_length)
+    best_index = searcher.search(bitboard.pack_board(board), NUMBER_OF_MOVES * searches_per_move)
+    if best_index is None:
+        return board, False
+    best_move = [move_left, move_up, move_down, move_right][best_index]
+    final_board, position_valid, _ = best_move(board)
+    return final_board, position_valid
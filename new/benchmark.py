@@ -0,0 +1,275 @@
+import argparse
+import csv
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import bitboard
+import expectimax
+import game_ai
+import game_records
+import ntuple
+import profiling
+from random_stream import RandomStream
+from transposition import TranspositionTable
+
+SAMPLE_COUNT = 50
+STRATEGIES = ("rollout", "batched", "timed", "expectimax")
+LATENCY_PERCENTILES = (50, 90, 99)
+CSV_FIELDS = ("seed", "moves", "score", "max_tile", "work", "seconds")
+
+
+def legal_move_count(board):
+    # Rollouts only run below legal first moves.
+    return bitboard.legal_moves(board).bit_count()
+
+
+def rollout_chooser(batched, searches_per_move=None, search_length=None):
+    search = game_ai.batch_rollout_scores if batched else game_ai.rollout_scores
+
+    def choose(board, move_number, rng):
+        if searches_per_move is None:
+            searches, length = game_ai.get_search_params(move_number)
+        else:
+            searches, length = searches_per_move, search_length
+        scores = search(board, searches, length, rng)
+        return scores, searches * legal_move_count(board)
+
+    return choose
+
+
+def timed_chooser(time_limit, search_length):
+    def choose(board, move_number, rng):
+        scores, searches = game_ai.timed_rollout_scores(board, time_limit, search_length,
+                                                        rng=rng)
+        return scores, searches * legal_move_count(board)
+
+    return choose
+
+
+def expectimax_chooser(depth, ntuple_path=None):
+    heuristic = ntuple.NTupleNetwork.load(ntuple_path) if ntuple_path else None
+    searcher = expectimax.ExpectimaxSearch(depth=depth, heuristic=heuristic,
+                                           transposition_table=TranspositionTable())
+
+    def choose(board, move_number, rng):
+        nodes = searcher.nodes
+        _, values = searcher.best_move(board)
+        scores = [-np.inf if value is None else value for value in values]
+        return scores, searcher.nodes - nodes
+
+    return choose
+
+
+def make_chooser(options):
+    strategy = options["strategy"]
+    if strategy in ("rollout", "batched"):
+        return rollout_chooser(strategy == "batched", options.get("searches_per_move"),
+                               options.get("search_length"))
+    if strategy == "timed":
+        return timed_chooser(options["time_limit"], options["search_length"])
+    return expectimax_chooser(options["depth"], options.get("ntuple"))
+
+
+def play_game(seed, options):
+    profile = options.get("profile_seed") == seed
+    with profiling.maybe_collect(options.get("instrument"), profile, profile) as stats:
+        result = _play(seed, options)
+    if stats is not None:
+        stats.moves = result["moves"]
+        result["stats"] = stats
+    return result
+
+
+def _play(seed, options):
+    rng = RandomStream(seed)
+    choose = make_chooser(options)
+    board = bitboard.new_packed_game(rng)
+    score = 0
+    work = 0
+    latencies = []
+    start = time.perf_counter()
+    move_number = 0
+    steps = [] if options.get("record") else None
+    while options.get("max_moves") is None or move_number < options["max_moves"]:
+        move_number += 1
+        move_start = time.perf_counter()
+        if not bitboard.legal_moves(board):
+            break
+        scores, move_work = choose(board, move_number, rng)
+        best_move_index = int(np.argmax(game_ai.mask_illegal_moves(board, scores)))
+        moved_board, _, move_score = bitboard.MOVES[best_move_index](board)
+        spawned_board = bitboard.add_new_tile(moved_board, rng)
+        if steps is not None:
+            steps.append(game_records.make_step(board, best_move_index, moved_board,
+                                                spawned_board, move_score))
+        board = spawned_board
+        latencies.append(time.perf_counter() - move_start)
+        score += move_score
+        work += move_work
+    result = {
+        "seed": seed,
+        "moves": len(latencies),
+        "score": score,
+        "max_tile": bitboard.max_tile(board),
+        "work": work,
+        "seconds": time.perf_counter() - start,
+        "latencies": latencies,
+    }
+    if steps is not None:
+        result["steps"] = np.array(steps, dtype=game_records.STEP_DTYPE)
+        result["final_board"] = board
+    return result
+
+
+def _play_game(args):
+    return play_game(*args)
+
+
+def run_benchmark(options, games=SAMPLE_COUNT, seed=0, workers=1, record=None):
+    # options["instrument"] collects profiling.Stats for every game, and
+    # options["profile"] adds cProfile and tracemalloc capture to the first.
+    options = dict(options, record=record is not None)
+    if options.get("profile"):
+        options["profile_seed"] = seed
+    jobs = [(seed + game, options) for game in range(games)]
+    start = time.perf_counter()
+    writer = game_records.GameRecordWriter(record) if record else None
+    try:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = [_record_game(writer, result)
+                           for result in pool.map(_play_game, jobs)]
+        else:
+            results = [_record_game(writer, _play_game(job)) for job in jobs]
+    finally:
+        if writer:
+            writer.close()
+    return summarize(results, options, time.perf_counter() - start, workers)
+
+
+def _record_game(writer, result):
+    # Games are appended as they finish, so an interrupted run keeps its log.
+    if writer:
+        writer.write_game(result["seed"], result.pop("steps"), result.pop("final_board"))
+    return result
+
+
+def summarize(results, options, wall_seconds, workers):
+    latencies = np.concatenate([result["latencies"] for result in results] or [[]])
+    moves = sum(result["moves"] for result in results)
+    work = sum(result["work"] for result in results)
+    cpu_seconds = sum(result["seconds"] for result in results)
+    scores = np.array([result["score"] for result in results])
+    max_tiles, tile_counts = np.unique([result["max_tile"] for result in results],
+                                       return_counts=True)
+    summary = {
+        "options": options,
+        "games": len(results),
+        "workers": workers,
+        "wall_seconds": wall_seconds,
+        "moves": moves,
+        # Per-game rates divide by the summed game times, so they ignore
+        # parallelism; the wall rates are the throughput of the whole run.
+        "moves_per_second": moves / cpu_seconds if cpu_seconds else 0.0,
+        "wall_moves_per_second": moves / wall_seconds if wall_seconds else 0.0,
+        "work": work,
+        "work_per_second": work / cpu_seconds if cpu_seconds else 0.0,
+        "wall_work_per_second": work / wall_seconds if wall_seconds else 0.0,
+        "latency_ms": {f"p{percentile}": float(np.percentile(latencies, percentile)) * 1000
+                       for percentile in LATENCY_PERCENTILES} if len(latencies) else {},
+        "score": {"mean": float(scores.mean()), "min": int(scores.min()),
+                  "median": float(np.median(scores)), "max": int(scores.max())},
+        "max_tiles": {str(tile): int(count) for tile, count in zip(max_tiles, tile_counts)},
+        "results": [{field: result[field] for field in CSV_FIELDS} for result in results],
+    }
+    game_stats = [result["stats"] for result in results if "stats" in result]
+    if game_stats:
+        total = profiling.Stats()
+        for stats in game_stats:
+            total.merge(stats)
+            total.wall_seconds += stats.wall_seconds
+        summary["stats"] = total.as_dict()
+        summary["profile"] = next((stats.profile for stats in game_stats if stats.profile), None)
+        summary["memory"] = next((stats.memory for stats in game_stats if stats.memory), None)
+    return summary
+
+
+def write_json(summary, path):
+    with open(path, "w") as output:
+        json.dump(summary, output, indent=2)
+
+
+def write_csv(summary, path):
+    with open(path, "w", newline="") as output:
+        writer = csv.DictWriter(output, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        writer.writerows(summary["results"])
+
+
+def plot_max_tiles(summary):
+    import matplotlib.pyplot as plt
+
+    tick_locations = np.arange(1, 16)
+    all_counts = np.zeros(len(tick_locations))
+    for tile, count in summary["max_tiles"].items():
+        all_counts[int(np.log2(int(tile))) - 1] = count
+
+    plt.bar(tick_locations, all_counts)
+    plt.xticks(tick_locations, np.power(2, tick_locations))
+    plt.xlabel("Max tile of game", fontsize=24)
+    plt.ylabel(f"Frequency per {summary['games']} runs", fontsize=24)
+    plt.show()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless 2048 AI self-play benchmark")
+    parser.add_argument("--strategy", choices=STRATEGIES, default="batched")
+    parser.add_argument("--games", type=int, default=SAMPLE_COUNT)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--searches-per-move", type=int)
+    parser.add_argument("--search-length", type=int)
+    parser.add_argument("--time-limit", type=float, default=0.02)
+    parser.add_argument("--depth", type=int, default=expectimax.SEARCH_DEPTH)
+    parser.add_argument("--max-moves", type=int)
+    parser.add_argument("--ntuple", help="n-tuple weight file to evaluate expectimax leaves with")
+    parser.add_argument("--json", help="write the summary to this JSON file")
+    parser.add_argument("--csv", help="write per-game results to this CSV file")
+    parser.add_argument("--record", help="append every game to this binary game record")
+    parser.add_argument("--instrument", action="store_true",
+                        help="collect engine counters and timers for every game")
+    parser.add_argument("--profile", action="store_true",
+                        help="run cProfile and tracemalloc over the first game")
+    parser.add_argument("--plot", action="store_true", help="show a max tile histogram")
+    args = parser.parse_args()
+
+    options = {"strategy": args.strategy, "max_moves": args.max_moves,
+               "instrument": args.instrument, "profile": args.profile}
+    if args.strategy in ("rollout", "batched") and args.searches_per_move:
+        options["searches_per_move"] = args.searches_per_move
+        options["search_length"] = args.search_length or game_ai.SL_SCALE_PARAM
+    elif args.strategy == "timed":
+        options["time_limit"] = args.time_limit
+        options["search_length"] = args.search_length or game_ai.SL_SCALE_PARAM
+    elif args.strategy == "expectimax":
+        options["depth"] = args.depth
+        options["ntuple"] = args.ntuple
+
+    summary = run_benchmark(options, args.games, args.seed, args.workers, args.record)
+    if args.json:
+        write_json(summary, args.json)
+    if args.csv:
+        write_csv(summary, args.csv)
+    report = {key: value for key, value in summary.items() if key not in ("results", "profile")}
+    print(json.dumps(report, indent=2))
+    if summary.get("profile"):
+        print(summary["profile"])
+    if args.plot:
+        plot_max_tiles(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,526 @@
+import numpy as np
+
+from random_stream import default_stream
+
+# A board is a single 64-bit integer holding sixteen 4-bit log2 exponents.
+# Cell (row, col) lives in nibble row * 4 + col, so each 16-bit slice is one
+# board row with column 0 in the low nibble. An exponent of 0 is an empty cell.
+
+ROW_COUNT = 4
+CELL_BITS = 4
+ROW_BITS = 16
+ROW_MASK = 0xFFFF
+CELL_MASK = 0xF
+MAX_EXPONENT = 15
+TABLE_SIZE = 1 << ROW_BITS
+
+CELL_SHIFTS = np.arange(0, 64, CELL_BITS, dtype=np.uint64)
+ROW_SHIFTS = np.arange(0, 64, ROW_BITS, dtype=np.uint64)
+
+LEFT, UP, DOWN, RIGHT = range(4)
+NEW_TILE_EXPONENTS = [1, 1, 1, 1, 1, 1, 1, 1, 1, 2]
+# (exponent, probability) for every tile a spawn can place: a 2 nine times in
+# ten, otherwise a 4.
+TILE_PROBABILITIES = tuple(
+    (exponent, NEW_TILE_EXPONENTS.count(exponent) / len(NEW_TILE_EXPONENTS))
+    for exponent in sorted(set(NEW_TILE_EXPONENTS)))
+NIBBLE_LOW_BITS = 0x1111111111111111
+
+
+def _row_cells(rows):
+    return np.stack([(rows >> (CELL_BITS * i)) & CELL_MASK for i in range(ROW_COUNT)], axis=1)
+
+
+def _cells_to_rows(cells):
+    rows = np.zeros(len(cells), dtype=np.uint64)
+    for i in range(ROW_COUNT):
+        rows |= cells[:, i].astype(np.uint64) << np.uint64(CELL_BITS * i)
+    return rows
+
+
+def _compact_left(cells):
+    order = np.argsort(cells == 0, axis=1, kind="stable")
+    return np.take_along_axis(cells, order, axis=1)
+
+
+def _reverse_rows(rows):
+    cells = _row_cells(rows)
+    return _cells_to_rows(cells[:, ::-1])
+
+
+def _spread_rows(rows):
+    # Lay a 16-bit row out as a column: nibble i moves to bit 16 * i.
+    rows = rows.astype(np.uint64)
+    return ((rows & np.uint64(0x000F))
+            | ((rows & np.uint64(0x00F0)) << np.uint64(12))
+            | ((rows & np.uint64(0x0F00)) << np.uint64(24))
+            | ((rows & np.uint64(0xF000)) << np.uint64(36)))
+
+
+def _build_left_tables():
+    rows = np.arange(TABLE_SIZE, dtype=np.uint64)
+    cells = _compact_left(_row_cells(rows).astype(np.int64))
+    scores = np.zeros(TABLE_SIZE, dtype=np.int64)
+    for col in range(ROW_COUNT - 1):
+        merge = ((cells[:, col] == cells[:, col + 1])
+                 & (cells[:, col] != 0)
+                 & (cells[:, col] < MAX_EXPONENT))
+        cells[merge, col] += 1
+        cells[merge, col + 1] = 0
+        scores[merge] += 1 << cells[merge, col]
+    cells = _compact_left(cells)
+    return _cells_to_rows(cells), scores
+
+
+def _build_tables():
+    rows = np.arange(TABLE_SIZE, dtype=np.uint64)
+    reversed_rows = _reverse_rows(rows)
+    left, left_score = _build_left_tables()
+    right = _reverse_rows(left[reversed_rows.astype(np.intp)])
+    right_score = left_score[reversed_rows.astype(np.intp)]
+    return {
+        "left": left,
+        "right": right,
+        "left_score": left_score,
+        "right_score": right_score,
+        "left_delta": left ^ rows,
+        "right_delta": right ^ rows,
+        "up_delta": _spread_rows(left ^ rows),
+        "down_delta": _spread_rows(right ^ rows),
+    }
+
+
+_TABLES = _build_tables()
+
+# NumPy tables, indexed by a packed 16-bit row.
+ROW_LEFT = _TABLES["left"]
+ROW_RIGHT = _TABLES["right"]
+ROW_LEFT_SCORE = _TABLES["left_score"]
+ROW_RIGHT_SCORE = _TABLES["right_score"]
+ROW_LEFT_MOVED = _TABLES["left_delta"] != 0
+ROW_RIGHT_MOVED = _TABLES["right_delta"] != 0
+
+# XOR deltas: applying a move is board ^ delta. The column tables hold the
+# delta already spread into column layout, so up/down need one transpose.
+ROW_LEFT_DELTA = _TABLES["left_delta"]
+ROW_RIGHT_DELTA = _TABLES["right_delta"]
+COL_UP_DELTA = _TABLES["up_delta"]
+COL_DOWN_DELTA = _TABLES["down_delta"]
+
+# Legal-move bits contributed by one row (left/right) or one transposed column
+# (up/down); OR-ing eight lookups gives a board's legal-move mask.
+_ROW_LEGAL = ((ROW_LEFT_MOVED.astype(np.int64) << LEFT)
+              | (ROW_RIGHT_MOVED.astype(np.int64) << RIGHT)).tolist()
+_COL_LEGAL = ((ROW_LEFT_MOVED.astype(np.int64) << UP)
+              | (ROW_RIGHT_MOVED.astype(np.int64) << DOWN)).tolist()
+LEGAL_MOVE_LISTS = [[move_index for move_index in range(4) if mask >> move_index & 1]
+                    for mask in range(16)]
+
+# Stacked by direction for the batch path; up/down run on transposed boards
+# with the left/right row tables.
+_BATCH_DELTA = np.stack([ROW_LEFT_DELTA, ROW_LEFT_DELTA, ROW_RIGHT_DELTA, ROW_RIGHT_DELTA])
+_BATCH_SCORE = np.stack([ROW_LEFT_SCORE, ROW_LEFT_SCORE, ROW_RIGHT_SCORE, ROW_RIGHT_SCORE])
+_VERTICAL = np.array([False, True, True, False])
+
+# Python-int copies for the scalar path; list indexing beats NumPy scalars.
+_LEFT_DELTA = ROW_LEFT_DELTA.tolist()
+_RIGHT_DELTA = ROW_RIGHT_DELTA.tolist()
+_UP_DELTA = COL_UP_DELTA.tolist()
+_DOWN_DELTA = COL_DOWN_DELTA.tolist()
+_LEFT_SCORE = ROW_LEFT_SCORE.tolist()
+_RIGHT_SCORE = ROW_RIGHT_SCORE.tolist()
+
+del _TABLES
+
+# For a row's empty-cell mask (bit 4 * i set when cell i is empty), the shifts
+# of its empty cells in order; lets a spawn pick the k-th empty cell directly.
+_ROW_EMPTY_SHIFTS = [[shift for shift in range(0, ROW_BITS, CELL_BITS) if mask >> shift & 1]
+                     for mask in range(0x1112)]
+
+
+def _board_exponents(boards):
+    # Exponents of 4x4 tile boards; anything that would not fit a nibble per
+    # cell is refused rather than spilling into the neighbouring cell.
+    boards = np.asarray(boards)
+    if boards.shape[-2:] != (ROW_COUNT, ROW_COUNT):
+        raise ValueError(f"expected {ROW_COUNT}x{ROW_COUNT} boards, got shape {boards.shape}")
+    if boards.size and boards.max() >= 1 << (MAX_EXPONENT + 1):
+        raise ValueError(f"tiles must be below {1 << (MAX_EXPONENT + 1)} to pack")
+    exponents = np.zeros(boards.shape, dtype=np.uint64)
+    filled = boards > 0
+    exponents[filled] = np.log2(boards[filled]).astype(np.uint64)
+    return exponents.reshape((-1, ROW_COUNT * ROW_COUNT))
+
+
+def pack_board(board):
+    exponents = _board_exponents(board)
+    if len(exponents) != 1:
+        raise ValueError(f"expected one board, got shape {np.shape(board)}")
+    return int(np.bitwise_or.reduce(exponents[0] << CELL_SHIFTS))
+
+
+def unpack_board(packed):
+    exponents = (np.uint64(packed) >> CELL_SHIFTS) & np.uint64(CELL_MASK)
+    board = np.where(exponents > 0, np.left_shift(1, exponents.astype(np.int64)), 0)
+    return board.reshape((ROW_COUNT, ROW_COUNT))
+
+
+def pack_boards(boards):
+    return np.bitwise_or.reduce(_board_exponents(boards) << CELL_SHIFTS, axis=1)
+
+
+def unpack_boards(packed):
+    packed = np.asarray(packed, dtype=np.uint64)
+    exponents = (packed[:, None] >> CELL_SHIFTS) & np.uint64(CELL_MASK)
+    boards = np.where(exponents > 0, np.left_shift(1, exponents.astype(np.int64)), 0)
+    return boards.reshape((-1, ROW_COUNT, ROW_COUNT))
+
+
+def transpose(board):
+    a1 = board & 0xF0F00F0FF0F00F0F
+    a2 = board & 0x0000F0F00000F0F0
+    a3 = board & 0x0F0F00000F0F0000
+    a = a1 | (a2 << 12) | (a3 >> 12)
+    b1 = a & 0xFF00FF0000FF00FF
+    b2 = a & 0x00FF00FF00000000
+    b3 = a & 0x00000000FF00FF00
+    return b1 | (b2 >> 24) | (b3 << 24)
+
+
+def move_left(board):
+    r0 = board & ROW_MASK
+    r1 = (board >> 16) & ROW_MASK
+    r2 = (board >> 32) & ROW_MASK
+    r3 = board >> 48
+    new_board = board ^ (_LEFT_DELTA[r0] | _LEFT_DELTA[r1] << 16
+                         | _LEFT_DELTA[r2] << 32 | _LEFT_DELTA[r3] << 48)
+    score = _LEFT_SCORE[r0] + _LEFT_SCORE[r1] + _LEFT_SCORE[r2] + _LEFT_SCORE[r3]
+    return new_board, new_board != board, score
+
+
+def move_right(board):
+    r0 = board & ROW_MASK
+    r1 = (board >> 16) & ROW_MASK
+    r2 = (board >> 32) & ROW_MASK
+    r3 = board >> 48
+    new_board = board ^ (_RIGHT_DELTA[r0] | _RIGHT_DELTA[r1] << 16
+                         | _RIGHT_DELTA[r2] << 32 | _RIGHT_DELTA[r3] << 48)
+    score = _RIGHT_SCORE[r0] + _RIGHT_SCORE[r1] + _RIGHT_SCORE[r2] + _RIGHT_SCORE[r3]
+    return new_board, new_board != board, score
+
+
+def move_up(board):
+    t = transpose(board)
+    c0 = t & ROW_MASK
+    c1 = (t >> 16) & ROW_MASK
+    c2 = (t >> 32) & ROW_MASK
+    c3 = t >> 48
+    new_board = board ^ (_UP_DELTA[c0] | _UP_DELTA[c1] << 4
+                         | _UP_DELTA[c2] << 8 | _UP_DELTA[c3] << 12)
+    score = _LEFT_SCORE[c0] + _LEFT_SCORE[c1] + _LEFT_SCORE[c2] + _LEFT_SCORE[c3]
+    return new_board, new_board != board, score
+
+
+def move_down(board):
+    t = transpose(board)
+    c0 = t & ROW_MASK
+    c1 = (t >> 16) & ROW_MASK
+    c2 = (t >> 32) & ROW_MASK
+    c3 = t >> 48
+    new_board = board ^ (_DOWN_DELTA[c0] | _DOWN_DELTA[c1] << 4
+                         | _DOWN_DELTA[c2] << 8 | _DOWN_DELTA[c3] << 12)
+    score = _RIGHT_SCORE[c0] + _RIGHT_SCORE[c1] + _RIGHT_SCORE[c2] + _RIGHT_SCORE[c3]
+    return new_board, new_board != board, score
+
+
+def transpose_boards(boards):
+    a1 = boards & np.uint64(0xF0F00F0FF0F00F0F)
+    a2 = boards & np.uint64(0x0000F0F00000F0F0)
+    a3 = boards & np.uint64(0x0F0F00000F0F0000)
+    a = a1 | (a2 << np.uint64(12)) | (a3 >> np.uint64(12))
+    b1 = a & np.uint64(0xFF00FF0000FF00FF)
+    b2 = a & np.uint64(0x00FF00FF00000000)
+    b3 = a & np.uint64(0x00000000FF00FF00)
+    return b1 | (b2 >> np.uint64(24)) | (b3 << np.uint64(24))
+
+
+def move_boards(boards, directions):
+    boards = np.asarray(boards, dtype=np.uint64)
+    directions = np.broadcast_to(np.asarray(directions, dtype=np.intp), boards.shape)
+    vertical = _VERTICAL[directions]
+    source = np.where(vertical, transpose_boards(boards), boards)
+    rows = ((source[:, None] >> ROW_SHIFTS) & np.uint64(ROW_MASK)).astype(np.intp)
+    table = directions[:, None]
+    delta = np.bitwise_or.reduce(_BATCH_DELTA[table, rows] << ROW_SHIFTS, axis=1)
+    moved_source = source ^ delta
+    new_boards = np.where(vertical, transpose_boards(moved_source), moved_source)
+    scores = _BATCH_SCORE[table, rows].sum(axis=1)
+    return new_boards, delta != 0, scores
+
+
+def legal_moves(board):
+    t = transpose(board)
+    return (_ROW_LEGAL[board & ROW_MASK] | _ROW_LEGAL[(board >> 16) & ROW_MASK]
+            | _ROW_LEGAL[(board >> 32) & ROW_MASK] | _ROW_LEGAL[board >> 48]
+            | _COL_LEGAL[t & ROW_MASK] | _COL_LEGAL[(t >> 16) & ROW_MASK]
+            | _COL_LEGAL[(t >> 32) & ROW_MASK] | _COL_LEGAL[t >> 48])
+
+
+def legal_move_masks(boards):
+    boards = np.asarray(boards, dtype=np.uint64)
+    rows = ((boards[:, None] >> ROW_SHIFTS) & np.uint64(ROW_MASK)).astype(np.intp)
+    cols = ((transpose_boards(boards)[:, None] >> ROW_SHIFTS) & np.uint64(ROW_MASK)).astype(np.intp)
+    legal = np.empty((len(boards), 4), dtype=bool)
+    legal[:, LEFT] = ROW_LEFT_MOVED[rows].any(axis=1)
+    legal[:, RIGHT] = ROW_RIGHT_MOVED[rows].any(axis=1)
+    legal[:, UP] = ROW_LEFT_MOVED[cols].any(axis=1)
+    legal[:, DOWN] = ROW_RIGHT_MOVED[cols].any(axis=1)
+    return legal
+
+
+def empty_mask(board):
+    # Bit 4 * i is set when cell i is empty.
+    filled = board | (board >> 2)
+    filled |= filled >> 1
+    return (filled & NIBBLE_LOW_BITS) ^ NIBBLE_LOW_BITS
+
+
+def empty_count(board):
+    return empty_mask(board).bit_count()
+
+
+def empty_cells(board):
+    empty = empty_mask(board)
+    cells = []
+    while empty:
+        lowest = empty & -empty
+        cells.append((lowest.bit_length() - 1) >> 2)
+        empty ^= lowest
+    return cells
+
+
+def empty_cell_masks(boards):
+    return ((boards[:, None] >> CELL_SHIFTS) & np.uint64(CELL_MASK)) == 0
+
+
+def choose_legal_moves(legal, rng):
+    # A uniformly random legal move for every row of a (boards, 4) legal-move
+    # mask, and whether the board had any. Shared with board_engine.
+    choice = np.where(legal, rng.generator.random(legal.shape), -1.0).argmax(axis=1)
+    return choice, legal.any(axis=1)
+
+
+def draw_spawns(empty, rng):
+    # One uniform draw per board picks both the k-th empty cell and the tile.
+    # empty is a (boards, cells) mask; returns each board's cell index and
+    # exponent, and which boards had room. Shared with board_engine.
+    counts = empty.sum(axis=1)
+    draws = (rng.generator.random(len(empty)) * counts * len(NEW_TILE_EXPONENTS)).astype(np.int64)
+    ranks, tile_indices = np.divmod(draws, len(NEW_TILE_EXPONENTS))
+    cells = (np.cumsum(empty, axis=1) > ranks[:, None]).argmax(axis=1)
+    return cells, np.asarray(NEW_TILE_EXPONENTS, dtype=np.uint64)[tile_indices], counts > 0
+
+
+def random_moves(boards, rng=None):
+    if rng is None:
+        rng = default_stream()
+    boards = np.asarray(boards, dtype=np.uint64)
+    choice, valid = choose_legal_moves(legal_move_masks(boards), rng)
+    new_boards, _, scores = move_boards(boards, choice)
+    return np.where(valid, new_boards, boards), valid, np.where(valid, scores, 0)
+
+
+def add_new_tiles(boards, rng=None):
+    if rng is None:
+        rng = default_stream()
+    boards = np.asarray(boards, dtype=np.uint64)
+    cells, exponents, spawning = draw_spawns(empty_cell_masks(boards), rng)
+    tiles = exponents << (cells.astype(np.uint64) * np.uint64(CELL_BITS))
+    return boards | np.where(spawning, tiles, np.uint64(0))
+
+
+MOVES = [move_left, move_up, move_down, move_right]
+
+
+def _line_cells(move_index):
+    # Each line's cells, ordered from the edge the tiles move toward.
+    lines = []
+    for line in range(ROW_COUNT):
+        if move_index == LEFT:
+            cells = [line * ROW_COUNT + col for col in range(ROW_COUNT)]
+        elif move_index == RIGHT:
+            cells = [line * ROW_COUNT + col for col in reversed(range(ROW_COUNT))]
+        elif move_index == UP:
+            cells = [row * ROW_COUNT + line for row in range(ROW_COUNT)]
+        else:
+            cells = [row * ROW_COUNT + line for row in reversed(range(ROW_COUNT))]
+        lines.append(cells)
+    return lines
+
+
+_MOVE_LINES = [_line_cells(move_index) for move_index in range(4)]
+
+
+def move_plan(board, move_index):
+    # Where every tile goes: a list of (from_cell, to_cell, exponent, merged)
+    # with merged set on both tiles of a merging pair. Slower than the table
+    # moves; meant for animating a single real move.
+    plan = []
+    for cells in _MOVE_LINES[move_index]:
+        tiles = [(cell, (board >> (CELL_BITS * cell)) & CELL_MASK) for cell in cells]
+        tiles = [(cell, exponent) for cell, exponent in tiles if exponent]
+        target = 0
+        index = 0
+        while index < len(tiles):
+            cell, exponent = tiles[index]
+            if (index + 1 < len(tiles) and tiles[index + 1][1] == exponent
+                    and exponent < MAX_EXPONENT):
+                plan.append((cell, cells[target], exponent, True))
+                plan.append((tiles[index + 1][0], cells[target], exponent, True))
+                index += 2
+            else:
+                plan.append((cell, cells[target], exponent, False))
+                index += 1
+            target += 1
+    new_board, move_made, score = MOVES[move_index](board)
+    return new_board, move_made, score, plan
+
+
+def random_move(board, rng=None):
+    if rng is None:
+        rng = default_stream()
+    options = LEGAL_MOVE_LISTS[legal_moves(board)]
+    if not options:
+        return board, False, 0
+    return MOVES[options[rng.below(len(options))]](board)
+
+
+def add_new_tile(board, rng=None):
+    # One uniform draw picks both the k-th empty cell and the tile; the cell
+    # is found row by row through _ROW_EMPTY_SHIFTS, never by scanning cells.
+    if rng is None:
+        rng = default_stream()
+    empty = empty_mask(board)
+    if not empty:
+        # A full board has nowhere to spawn, as in add_new_tiles.
+        return board
+    draw = int(rng.random() * empty.bit_count() * len(NEW_TILE_EXPONENTS))
+    rank, tile_index = divmod(draw, len(NEW_TILE_EXPONENTS))
+    row_shift = 0
+    row_mask = empty & ROW_MASK
+    row_count = row_mask.bit_count()
+    while rank >= row_count:
+        rank -= row_count
+        row_shift += ROW_BITS
+        row_mask = (empty >> row_shift) & ROW_MASK
+        row_count = row_mask.bit_count()
+    shift = row_shift + _ROW_EMPTY_SHIFTS[row_mask][rank]
+    return board | (NEW_TILE_EXPONENTS[tile_index] << shift)
+
+
+def new_packed_game(rng=None):
+    # A fresh game: two 2s on distinct cells, as game_functions.initialize_game.
+    if rng is None:
+        rng = default_stream()
+    cells = rng.generator.choice(ROW_COUNT * ROW_COUNT, 2, replace=False)
+    return sum(1 << (CELL_BITS * int(cell)) for cell in cells)
+
+
+def max_tile(board):
+    exponent = max((board >> (CELL_BITS * i)) & CELL_MASK for i in range(16))
+    return 1 << exponent if exponent else 0
+
+
+# The eight board symmetries are numbered by three bits applied in order:
+# 4 transposes, 2 flips the rows top to bottom, 1 mirrors each row. Every
+# symmetry is its own bit-twiddle, so a canonical form needs no tables.
+SYMMETRY_COUNT = 8
+_TRANSPOSE_MOVES = [UP, LEFT, RIGHT, DOWN]
+_VERTICAL_FLIP_MOVES = [LEFT, DOWN, UP, RIGHT]
+_HORIZONTAL_FLIP_MOVES = [RIGHT, UP, DOWN, LEFT]
+
+
+def _symmetry_moves(transform):
+    moves = []
+    for move_index in range(4):
+        if transform & 4:
+            move_index = _TRANSPOSE_MOVES[move_index]
+        if transform & 2:
+            move_index = _VERTICAL_FLIP_MOVES[move_index]
+        if transform & 1:
+            move_index = _HORIZONTAL_FLIP_MOVES[move_index]
+        moves.append(move_index)
+    return moves
+
+
+# SYMMETRY_MOVES[t][m] is the move on the transformed board that matches move m
+# on the original; INVERSE_SYMMETRY_MOVES maps a canonical move back.
+SYMMETRY_MOVES = [_symmetry_moves(transform) for transform in range(SYMMETRY_COUNT)]
+INVERSE_SYMMETRY_MOVES = [[moves.index(move_index) for move_index in range(4)]
+                          for moves in SYMMETRY_MOVES]
+
+
+def mirror_rows(board):
+    board = ((board & 0x0F0F0F0F0F0F0F0F) << 4) | ((board >> 4) & 0x0F0F0F0F0F0F0F0F)
+    return ((board & 0x00FF00FF00FF00FF) << 8) | ((board >> 8) & 0x00FF00FF00FF00FF)
+
+
+def flip_rows(board):
+    board = ((board & 0x0000FFFF0000FFFF) << 16) | ((board >> 16) & 0x0000FFFF0000FFFF)
+    return ((board & 0xFFFFFFFF) << 32) | (board >> 32)
+
+
+def apply_symmetry(board, transform):
+    if transform & 4:
+        board = transpose(board)
+    if transform & 2:
+        board = flip_rows(board)
+    if transform & 1:
+        board = mirror_rows(board)
+    return board
+
+
+def symmetries(board):
+    # The board under each transform, indexed by transform number.
+    mirrored = mirror_rows(board)
+    t = transpose(board)
+    t_mirrored = mirror_rows(t)
+    return (board, mirrored, flip_rows(board), flip_rows(mirrored),
+            t, t_mirrored, flip_rows(t), flip_rows(t_mirrored))
+
+
+def canonical(board):
+    # Returns the smallest of the eight symmetric boards and the transform
+    # that produced it.
+    candidates = symmetries(board)
+    best = min(candidates)
+    return best, candidates.index(best)
+
+
+def _mirror_rows_batch(boards):
+    low = np.uint64(0x0F0F0F0F0F0F0F0F)
+    boards = ((boards & low) << np.uint64(4)) | ((boards >> np.uint64(4)) & low)
+    low = np.uint64(0x00FF00FF00FF00FF)
+    return ((boards & low) << np.uint64(8)) | ((boards >> np.uint64(8)) & low)
+
+
+def _flip_rows_batch(boards):
+    low = np.uint64(0x0000FFFF0000FFFF)
+    boards = ((boards & low) << np.uint64(16)) | ((boards >> np.uint64(16)) & low)
+    return (boards << np.uint64(32)) | (boards >> np.uint64(32))
+
+
+def symmetric_boards(boards):
+    # All eight symmetries of each board, one column per transform.
+    boards = np.asarray(boards, dtype=np.uint64)
+    mirrored = _mirror_rows_batch(boards)
+    t = transpose_boards(boards)
+    t_mirrored = _mirror_rows_batch(t)
+    return np.stack([boards, mirrored, _flip_rows_batch(boards), _flip_rows_batch(mirrored),
+                     t, t_mirrored, _flip_rows_batch(t), _flip_rows_batch(t_mirrored)], axis=1)
+
+
+def canonical_boards(boards):
+    candidates = symmetric_boards(boards)
+    transforms = candidates.argmin(axis=1)
+    return candidates[np.arange(len(candidates)), transforms], transforms
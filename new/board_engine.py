@@ -0,0 +1,155 @@
+import numpy as np
+
+import bitboard
+from random_stream import default_stream
+
+# Moves for rows x cols boards of any size, on uint8 arrays of log2 exponents.
+# A move turns every board into a stack of lines sliding towards index 0 and
+# slides all of them at once. Lines of up to TABLE_LINE_LIMIT cells are
+# packed into 4-bit codes and looked up in a per-length table, so a move is a
+# fixed handful of NumPy calls whatever the board size; longer lines, or
+# boards holding exponents too big for a nibble, take the vectorized
+# compact/merge/compact path, which costs a few array passes per column.
+# 4x4 games should keep using bitboard, which is faster still.
+
+LEFT, UP, DOWN, RIGHT = range(4)
+CELL_BITS = 4
+MAX_TABLE_EXPONENT = 15
+TABLE_LINE_LIMIT = 5
+
+_line_tables = {}
+_engines = {}
+
+
+def exponents_of(board):
+    board = np.asarray(board)
+    exponents = np.zeros(board.shape, dtype=np.uint8)
+    filled = board > 0
+    exponents[filled] = np.log2(board[filled]).astype(np.uint8)
+    return exponents
+
+
+def tiles_of(exponents):
+    return np.where(exponents > 0, np.left_shift(1, exponents.astype(np.int64)), 0)
+
+
+def _compact(lines):
+    order = np.argsort(lines == 0, axis=1, kind="stable")
+    return np.take_along_axis(lines, order, axis=1)
+
+
+def slide_lines(lines):
+    # Slides and merges each line towards index 0; returns the new lines and
+    # the merge score of each.
+    lines = _compact(lines)
+    scores = np.zeros(len(lines), dtype=np.int64)
+    for col in range(lines.shape[1] - 1):
+        same = (lines[:, col] == lines[:, col + 1]) & (lines[:, col] != 0)
+        lines[same, col] += 1
+        lines[same, col + 1] = 0
+        scores += np.where(same, np.left_shift(1, lines[:, col].astype(np.int64)), 0)
+    return _compact(lines), scores
+
+
+def line_tables(length):
+    # For every packed line of `length` cells: the packed line after sliding
+    # and its score. Built on first use; 16 ** 5 entries is about 8 MB.
+    if length not in _line_tables:
+        shifts = np.arange(0, CELL_BITS * length, CELL_BITS, dtype=np.int64)
+        codes = np.arange(1 << (CELL_BITS * length), dtype=np.int64)
+        lines = ((codes[:, None] >> shifts) & MAX_TABLE_EXPONENT).astype(np.uint8)
+        slid, scores = slide_lines(lines)
+        # A 15 + 15 merge does not fit a nibble; such lines never reach the
+        # table because table_slide only sees exponents below 15.
+        slid = np.minimum(slid, MAX_TABLE_EXPONENT).astype(np.int64)
+        _line_tables[length] = ((slid << shifts).sum(axis=1).astype(np.int32),
+                                scores.astype(np.int32), shifts)
+    return _line_tables[length]
+
+
+def table_slide(lines):
+    results, scores, shifts = line_tables(lines.shape[1])
+    codes = (lines.astype(np.int64) << shifts).sum(axis=1)
+    slid = ((results[codes][:, None] >> shifts) & MAX_TABLE_EXPONENT).astype(np.uint8)
+    return slid, scores[codes].astype(np.int64)
+
+
+class BoardEngine:
+    def __init__(self, rows, cols):
+        if rows < 2 or cols < 2:
+            raise ValueError("boards need at least two rows and two columns")
+        self.rows = rows
+        self.cols = cols
+        self.shape = (rows, cols)
+
+    def slide(self, lines):
+        if lines.shape[1] <= TABLE_LINE_LIMIT and lines.max(initial=0) < MAX_TABLE_EXPONENT:
+            return table_slide(lines)
+        return slide_lines(lines)
+
+    @staticmethod
+    def _oriented(boards, direction):
+        # A view of boards whose rows are the lines to slide towards index 0;
+        # the same indexing maps slid lines back.
+        if direction == LEFT:
+            return boards
+        if direction == RIGHT:
+            return boards[:, :, ::-1]
+        if direction == UP:
+            return boards.transpose(0, 2, 1)
+        return boards.transpose(0, 2, 1)[:, :, ::-1]
+
+    def move_boards(self, boards, directions):
+        boards = np.asarray(boards, dtype=np.uint8).reshape((-1,) + self.shape)
+        directions = np.broadcast_to(np.asarray(directions, dtype=np.intp), boards.shape[:1])
+        new_boards = boards.copy()
+        scores = np.zeros(len(boards), dtype=np.int64)
+        for direction in range(4):
+            selected = np.flatnonzero(directions == direction)
+            if not len(selected):
+                continue
+            oriented = self._oriented(boards[selected], direction)
+            lines, line_scores = self.slide(oriented.reshape(-1, oriented.shape[2]))
+            moved = np.empty_like(boards[selected])
+            self._oriented(moved, direction)[...] = lines.reshape(oriented.shape)
+            new_boards[selected] = moved
+            scores[selected] = line_scores.reshape(len(selected), -1).sum(axis=1)
+        moved = (new_boards != boards).any(axis=(1, 2))
+        return new_boards, moved, scores
+
+    def move(self, board, direction):
+        board = np.asarray(board, dtype=np.uint8)
+        oriented = self._oriented(board[None], direction)[0]
+        lines, scores = self.slide(oriented)
+        new_board = np.empty_like(board)
+        self._oriented(new_board[None], direction)[0][...] = lines
+        return new_board, bool((new_board != board).any()), int(scores.sum())
+
+    def legal_move_masks(self, boards):
+        boards = np.asarray(boards, dtype=np.uint8).reshape((-1,) + self.shape)
+        return np.stack([self.move_boards(boards, direction)[1] for direction in range(4)],
+                        axis=1)
+
+    def random_moves(self, boards, rng=None):
+        if rng is None:
+            rng = default_stream()
+        boards = np.asarray(boards, dtype=np.uint8).reshape((-1,) + self.shape)
+        choice, valid = bitboard.choose_legal_moves(self.legal_move_masks(boards), rng)
+        new_boards, _, scores = self.move_boards(boards, choice)
+        return (np.where(valid[:, None, None], new_boards, boards), valid,
+                np.where(valid, scores, 0))
+
+    def add_new_tiles(self, boards, rng=None):
+        if rng is None:
+            rng = default_stream()
+        boards = np.array(boards, dtype=np.uint8).reshape((-1,) + self.shape)
+        flat = boards.reshape(len(boards), -1)
+        cells, exponents, spawning = bitboard.draw_spawns(flat == 0, rng)
+        flat[spawning, cells[spawning]] = exponents[spawning].astype(np.uint8)
+        return boards
+
+
+def engine(rows, cols):
+    if (rows, cols) not in _engines:
+        _engines[rows, cols] = BoardEngine(rows, cols)
+    return _engines[rows, cols]
@@ -0,0 +1,149 @@
+import time
+
+import numpy as np
+
+import bitboard
+import heuristics
+import profiling
+from game_functions import is_packable, move_down, move_left, move_right, move_up
+
+SEARCH_DEPTH = 2
+PROBABILITY_CUTOFF = 0.0001
+MAX_TIMED_DEPTH = 8
+TIME_CHECK_INTERVAL = 256
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+def empty_cells_heuristic(board):
+    return float(len(bitboard.empty_cells(board)))
+
+
+empty_cells_heuristic.symmetric = True
+
+
+class ExpectimaxSearch:
+    def __init__(self, depth=SEARCH_DEPTH, probability_cutoff=PROBABILITY_CUTOFF,
+                 heuristic=None, transposition_table=None, symmetric=None):
+        self.depth = depth
+        self.probability_cutoff = probability_cutoff
+        if heuristic is None:
+            heuristic = heuristics.default_evaluator()
+        self.heuristic = heuristic
+        self.transposition_table = transposition_table
+        # Symmetric boards share a table entry when the heuristic cannot tell
+        # them apart.
+        if symmetric is None:
+            symmetric = getattr(heuristic, "symmetric", False)
+        self.symmetric = symmetric
+        self.game_over_value = heuristics.game_over_value(heuristic)
+        self.nodes = 0
+        self.deadline = None
+
+    def move_values(self, board, depth=None):
+        if depth is None:
+            depth = self.depth
+        values = []
+        nodes = self.nodes
+        try:
+            for move in bitboard.MOVES:
+                new_board, move_made, _ = move(board)
+                if move_made:
+                    values.append(self.chance_value(new_board, depth - 1, 1.0))
+                else:
+                    values.append(None)
+        finally:
+            profiling.add_work(nodes=self.nodes - nodes)
+        return values
+
+    def best_move(self, board, depth=None):
+        values = self.move_values(board, depth)
+        best_index = None
+        for move_index, value in enumerate(values):
+            if value is not None and (best_index is None or value > values[best_index]):
+                best_index = move_index
+        return best_index, values
+
+    def timed_best_move(self, board, time_limit, max_depth=MAX_TIMED_DEPTH):
+        best_index, values = self.best_move(board, 1)
+        depth_reached = 1
+        if best_index is None:
+            return best_index, values, depth_reached
+        self.deadline = time.perf_counter() + time_limit
+        try:
+            for depth in range(2, max_depth + 1):
+                best_index, values = self.best_move(board, depth)
+                depth_reached = depth
+        except SearchTimeout:
+            pass
+        finally:
+            self.deadline = None
+        return best_index, values, depth_reached
+
+    def max_value(self, board, depth, probability):
+        self.nodes += 1
+        best = None
+        for move in bitboard.MOVES:
+            new_board, move_made, _ = move(board)
+            if move_made:
+                value = self.chance_value(new_board, depth - 1, probability)
+                if best is None or value > best:
+                    best = value
+        return self.game_over_value if best is None else best
+
+    def chance_value(self, board, depth, probability):
+        self.nodes += 1
+        if (self.deadline is not None and not self.nodes % TIME_CHECK_INTERVAL
+                and time.perf_counter() > self.deadline):
+            raise SearchTimeout
+        if depth <= 0 or probability < self.probability_cutoff:
+            return self.heuristic(board)
+        table = self.transposition_table
+        if table is not None:
+            key = bitboard.canonical(board)[0] if self.symmetric else board
+            cached = table.lookup(key, depth)
+            if cached is not None:
+                return cached
+        cells = bitboard.empty_cells(board)
+        total = 0.0
+        for cell in cells:
+            shift = bitboard.CELL_BITS * cell
+            for exponent, tile_probability in bitboard.TILE_PROBABILITIES:
+                branch_probability = probability * tile_probability / len(cells)
+                total += tile_probability * self.max_value(board | (exponent << shift), depth,
+                                                           branch_probability)
+        value = total / len(cells)
+        if table is not None:
+            table.store(key, depth, value)
+        return value
+
+
+def _pack_searchable(board):
+    if not is_packable(board):
+        raise ValueError(f"expectimax only searches 4x4 boards with tiles below "
+                         f"{1 << bitboard.MAX_EXPONENT}, got shape {np.shape(board)}")
+    return bitboard.pack_board(board)
+
+
+def expectimax_move(board, searcher=None):
+    if searcher is None:
+        searcher = ExpectimaxSearch()
+    best_index, _ = searcher.best_move(_pack_searchable(board))
+    if best_index is None:
+        return board, False
+    best_move = [move_left, move_up, move_down, move_right][best_index]
+    new_board, move_made, _ = best_move(board)
+    return new_board, move_made
+
+
+def timed_expectimax_move(board, time_limit, searcher=None):
+    if searcher is None:
+        searcher = ExpectimaxSearch()
+    best_index, _, depth_reached = searcher.timed_best_move(_pack_searchable(board), time_limit)
+    if best_index is None:
+        return board, False, depth_reached
+    best_move = [move_left, move_up, move_down, move_right][best_index]
+    new_board, move_made, _ = best_move(board)
+    return new_board, move_made, depth_reached
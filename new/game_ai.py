@@ -1,17 +1,23 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
-import matplotlib.pyplot as plt
 
 NUMBER_OF_MOVES = 4
-SAMPLE_COUNT = 50
 
 SPM_SCALE_PARAM = 10
 SL_SCALE_PARAM = 4
 SEARCH_PARAM = 200
+TIMED_CHUNK_SIZE = 16
 
-from game_functions import initialize_game, random_move, \
-    move_down, move_left, \
+import bitboard
+import board_engine
+import heuristics
+import profiling
+from random_stream import RandomStream, default_stream
+from game_functions import move_down, move_left, \
     move_right, move_up, \
-    check_for_win, add_new_tile
+    check_for_win, add_new_tile, is_packable
 
 
 def get_search_params(move_number):
@@ -20,75 +26,247 @@ def get_search_params(move_number):
     return searches_per_move, search_length
 
 
-def ai_move(board, searches_per_move, search_length):
-    possible_first_moves = [move_left, move_up, move_down, move_right]
+def rollout_scores(packed_board, searches_per_move, search_length, rng=None, evaluator=None):
+    if rng is None:
+        rng = default_stream()
     first_move_scores = np.zeros(NUMBER_OF_MOVES)
+    rollouts = 0
     for first_move_index in range(NUMBER_OF_MOVES):
-        first_move_function = possible_first_moves[first_move_index]
-        board_with_first_move, first_move_made, first_move_score = first_move_function(board)
+        first_move_function = bitboard.MOVES[first_move_index]
+        board_with_first_move, first_move_made, first_move_score = first_move_function(packed_board)
         if first_move_made:
-            board_with_first_move = add_new_tile(board_with_first_move)
+            board_with_first_move = bitboard.add_new_tile(board_with_first_move, rng)
             first_move_scores[first_move_index] += first_move_score
         else:
             continue
+        rollouts += searches_per_move
         for _ in range(searches_per_move):
             move_number = 1
-            search_board = np.copy(board_with_first_move)
+            search_board = board_with_first_move
             game_valid = True
             while game_valid and move_number < search_length:
-                search_board, game_valid, score = random_move(search_board)
+                search_board, game_valid, score = bitboard.random_move(search_board, rng)
                 if game_valid:
-                    search_board = add_new_tile(search_board)
+                    search_board = bitboard.add_new_tile(search_board, rng)
                     first_move_scores[first_move_index] += score
                     move_number += 1
-    best_move_index = np.argmax(first_move_scores)
-    best_move = possible_first_moves[best_move_index]
-    print(board)
-    print(best_move)
-    search_board, game_valid, score = best_move(board)
-    return search_board, game_valid
+            if evaluator is not None:
+                # A rollout that ran into a lost board is valued as lost.
+                first_move_scores[first_move_index] += (
+                    evaluator(search_board) if bitboard.legal_moves(search_board)
+                    else heuristics.game_over_value(evaluator))
+    profiling.add_work(rollouts=rollouts)
+    return first_move_scores
 
 
-def ai_play(board):
-    move_number = 0
-    valid_game = True
-    while valid_game:
-        move_number += 1
-        number_of_simulations, search_length = get_search_params(move_number)
-        board, valid_game = ai_move(board, number_of_simulations, search_length)
-        if valid_game:
-            board = add_two(board)
-        if check_for_win(board):
-            valid_game = False
-        print(board)
-        print(move_number)
-    print(board)
-    return np.amax(board)
+def search_boards(board):
+    # A tile board as the one-board batch the rollout search works on: packed
+    # into uint64 when bitboard can hold it, else a grid of exponents.
+    if is_packable(board):
+        return np.array([bitboard.pack_board(board)], dtype=np.uint64)
+    return board_engine.exponents_of(board)[None]
+
+
+def engine_of(boards):
+    # Packed batches run on the bitboard module itself, which exposes the
+    # same move_boards / random_moves / add_new_tiles / legal_move_masks
+    # functions as a board_engine.BoardEngine does for exponent grids.
+    if boards.dtype == np.uint64:
+        return bitboard
+    return board_engine.engine(*boards.shape[1:])
+
+
+def engine_rollout_scores(boards, searches_per_move, search_length, rng=None, evaluator=None):
+    if rng is None:
+        rng = default_stream()
+    engine = engine_of(boards)
+    first_boards, first_moves_made, first_scores = engine.move_boards(
+        np.repeat(boards, NUMBER_OF_MOVES, axis=0), np.arange(NUMBER_OF_MOVES))
+    first_move_scores = np.where(first_moves_made, first_scores, 0).astype(float)
+    first_boards = engine.add_new_tiles(first_boards, rng)
+
+    owners = np.repeat(np.flatnonzero(first_moves_made), searches_per_move)
+    rollout_boards = first_boards[owners]
+    active = np.ones(len(owners), dtype=bool)
+    for _ in range(search_length - 1):
+        playing = np.flatnonzero(active)
+        if not len(playing):
+            break
+        moved_boards, game_valid, scores = engine.random_moves(rollout_boards[playing], rng)
+        rollout_boards[playing] = engine.add_new_tiles(moved_boards, rng)
+        first_move_scores += np.bincount(owners[playing], weights=scores, minlength=NUMBER_OF_MOVES)
+        active[playing] = game_valid
+    if evaluator is not None:
+        # Rollouts that ran into a lost board are valued as lost.
+        values = np.where(engine.legal_move_masks(rollout_boards).any(axis=1),
+                          evaluator.evaluate_boards(rollout_boards),
+                          heuristics.game_over_value(evaluator))
+        first_move_scores += np.bincount(owners, weights=values, minlength=NUMBER_OF_MOVES)
+    profiling.add_work(rollouts=len(owners))
+    return first_move_scores
+
+
+def batch_rollout_scores(packed_board, searches_per_move, search_length, rng=None,
+                         evaluator=None):
+    return engine_rollout_scores(np.array([packed_board], dtype=np.uint64), searches_per_move,
+                                 search_length, rng, evaluator)
+
+
+def mask_illegal_moves(packed_board, first_move_scores):
+    legal = bitboard.legal_moves(packed_board)
+    return [score if legal >> move_index & 1 else -np.inf
+            for move_index, score in enumerate(first_move_scores)]
+
+
+def engine_immediate_scores(boards):
+    _, first_moves_made, first_scores = engine_of(boards).move_boards(
+        np.repeat(boards, NUMBER_OF_MOVES, axis=0), np.arange(NUMBER_OF_MOVES))
+    return np.where(first_moves_made, first_scores, 0).astype(float)
+
+
+def immediate_scores(packed_board):
+    return engine_immediate_scores(np.array([packed_board], dtype=np.uint64))
+
 
+_worker_pool = None
+_worker_count = 0
 
-def ai_plot(move_func):
-    tick_locations = np.arange(1, 12)
-    final_scores = []
-    for _ in range(SAMPLE_COUNT):
-        print('thing is ', _)
-        board = initialize_game()
-        game_is_win = ai(board)
-        final_scores.append(game_is_win)
-    all_counts = np.zeros(11)
-    unique, counts = np.unique(np.array(final_scores), return_counts=True)
-    unique = np.log2(unique).astype(int)
-    index = 0
 
-    for tick in tick_locations:
-        if tick in unique:
-            all_counts[tick - 1] = counts[index]
-            index += 1
+def _rollout_search(boards, searches_per_move, search_length, batched, rng):
+    # Only packed boards have a scalar rollout loop; exponent grids always
+    # run batched.
+    if batched or boards.dtype != np.uint64:
+        return engine_rollout_scores(boards, searches_per_move, search_length, rng)
+    return rollout_scores(int(boards[0]), searches_per_move, search_length, rng)
 
-    plt.bar(tick_locations, all_counts)
-    plt.xticks(tick_locations, np.power(2, tick_locations))
-    plt.xlabel("Score of Game", fontsize=24)
-    plt.ylabel(f"Frequency per {SAMPLE_COUNT} runs", fontsize=24)
-    plt.show()
 
+def _search_chunk(boards, searches_per_move, search_length, batched, seed_sequence):
+    scores = _rollout_search(boards, searches_per_move, search_length, batched,
+                             RandomStream(seed_sequence))
+    return scores - engine_immediate_scores(boards)
 
 
+def get_worker_pool(workers):
+    global _worker_pool, _worker_count
+    if _worker_pool is None or _worker_count != workers:
+        shutdown_worker_pool()
+        _worker_pool = ProcessPoolExecutor(max_workers=workers)
+        _worker_count = workers
+    return _worker_pool
+
+
+def shutdown_worker_pool():
+    global _worker_pool, _worker_count
+    if _worker_pool is not None:
+        _worker_pool.shutdown()
+    _worker_pool = None
+    _worker_count = 0
+
+
+def parallel_rollout_scores(boards, searches_per_move, search_length, workers, batched=False,
+                            rng=None):
+    # boards is a one-board batch from search_boards. Each chunk gets its own
+    # child seed, so results do not depend on which worker happens to run it.
+    if rng is None:
+        rng = default_stream()
+    pool = get_worker_pool(workers)
+    chunk_sizes = [searches_per_move // workers + (chunk < searches_per_move % workers)
+                   for chunk in range(workers)]
+    chunk_sizes = [chunk_size for chunk_size in chunk_sizes if chunk_size]
+    seed_sequences = rng.seed_sequence.spawn(len(chunk_sizes))
+    futures = [pool.submit(_search_chunk, boards, chunk_size, search_length, batched,
+                           seed_sequence)
+               for chunk_size, seed_sequence in zip(chunk_sizes, seed_sequences)]
+    scores = engine_immediate_scores(boards)
+    for future in futures:
+        scores += future.result()
+    # Workers count into their own processes; credit their rollouts here.
+    legal_count = int(engine_of(boards).legal_move_masks(boards)[0].sum())
+    profiling.add_work(rollouts=searches_per_move * legal_count)
+    return scores
+
+
+def ai_move(board, searches_per_move, search_length, batched=False, workers=None, rng=None,
+            instrument=False):
+    # With instrument=True a profiling.Stats for this call is returned as well.
+    possible_first_moves = [move_left, move_up, move_down, move_right]
+    with profiling.maybe_collect(instrument) as stats:
+        boards = search_boards(board)
+        if workers:
+            first_move_scores = parallel_rollout_scores(boards, searches_per_move, search_length,
+                                                        workers, batched, rng)
+        else:
+            first_move_scores = _rollout_search(boards, searches_per_move, search_length, batched,
+                                                rng)
+        first_move_scores = np.where(engine_of(boards).legal_move_masks(boards)[0],
+                                     first_move_scores, -np.inf)
+        best_move_index = np.argmax(first_move_scores)
+        best_move = possible_first_moves[best_move_index]
+        search_board, game_valid, score = best_move(board)
+        if instrument:
+            stats.moves += 1
+    if instrument:
+        return search_board, game_valid, stats
+    return search_board, game_valid
+
+
+def engine_timed_rollout_scores(boards, time_limit, search_length, chunk_size=TIMED_CHUNK_SIZE,
+                                rng=None):
+    start = time.perf_counter()
+    immediate = engine_immediate_scores(boards)
+    scores = immediate.copy()
+    searches = 0
+    round_time = 0.0
+    while not searches or time.perf_counter() - start + round_time <= time_limit:
+        round_start = time.perf_counter()
+        scores += engine_rollout_scores(boards, chunk_size, search_length, rng) - immediate
+        searches += chunk_size
+        round_time = time.perf_counter() - round_start
+    return scores, searches
+
+
+def timed_rollout_scores(packed_board, time_limit, search_length, chunk_size=TIMED_CHUNK_SIZE,
+                         rng=None):
+    return engine_timed_rollout_scores(np.array([packed_board], dtype=np.uint64), time_limit,
+                                       search_length, chunk_size, rng)
+
+
+def timed_ai_move(board, time_limit, search_length=SL_SCALE_PARAM, chunk_size=TIMED_CHUNK_SIZE,
+                  rng=None):
+    possible_first_moves = [move_left, move_up, move_down, move_right]
+    boards = search_boards(board)
+    first_move_scores, searches = engine_timed_rollout_scores(boards, time_limit, search_length,
+                                                              chunk_size, rng)
+    legal = engine_of(boards).legal_move_masks(boards)[0]
+    best_move = possible_first_moves[np.argmax(np.where(legal, first_move_scores, -np.inf))]
+    search_board, game_valid, score = best_move(board)
+    return search_board, game_valid, searches
+
+
+def ai_play(board, rng=None, instrument=False, profile=False, memory=False):
+    # Any of instrument, profile or memory returns a profiling.Stats for the
+    # whole game next to the max tile; profile adds a cProfile report and
+    # memory a tracemalloc summary.
+    instrument = instrument or profile or memory
+    move_number = 0
+    valid_game = True
+    with profiling.maybe_collect(instrument, profile, memory) as game_stats:
+        while valid_game:
+            move_number += 1
+            number_of_simulations, search_length = get_search_params(move_number)
+            if instrument:
+                board, valid_game, move_stats = ai_move(board, number_of_simulations,
+                                                        search_length, rng=rng, instrument=True)
+                game_stats.move_stats.append(move_stats)
+            else:
+                board, valid_game = ai_move(board, number_of_simulations, search_length, rng=rng)
+            if valid_game:
+                board = add_new_tile(board, rng)
+            if check_for_win(board):
+                valid_game = False
+            print(board)
+            print(move_number)
+    print(board)
+    if instrument:
+        return np.amax(board), game_stats
+    return np.amax(board)
@@ -1,11 +1,23 @@
+import argparse
+import queue
+import threading
+import time
 from tkinter import Frame, Label, CENTER
 
+import numpy as np
+
 import game_ai
 import game_functions
+from random_stream import default_stream
 
 EDGE_LENGTH = 400
 CELL_COUNT = 4
 CELL_PAD = 10
+FRAME_INTERVAL_MS = 16
+AI_POLL_INTERVAL_MS = 16
+AI_MOVE_RATE = None
+AI_SEARCHES_PER_MOVE = 40
+AI_SEARCH_LENGTH = 30
 
 UP_KEY = "'w'"
 DOWN_KEY = "'s'"
@@ -13,6 +25,7 @@ LEFT_KEY = "'a'"
 RIGHT_KEY = "'d'"
 AI_KEY = "'q'"
 AI_PLAY_KEY = "'p'"
+AI_CANCEL_KEY = "'c'"
 
 LABEL_FONT = ("Verdana", 40, "bold")
 
@@ -31,8 +44,55 @@ LABEL_COLORS = {2: "#011c08", 4: "#011c08", 8: "#011c08", 16: "#011c08",
                 2048: "#f2f2f0", 4096: "#f2f2f0", 8192: "#f2f2f0", }
 
 
+class AIWorker(threading.Thread):
+    # Plays AI moves on its own copy of the board and posts each resulting
+    # (matrix, valid_game) pair to the results queue for the UI to drain.
+    def __init__(self, matrix, results, move_rate=AI_MOVE_RATE,
+                 searches_per_move=AI_SEARCHES_PER_MOVE, search_length=AI_SEARCH_LENGTH):
+        threading.Thread.__init__(self, daemon=True)
+        self.matrix = np.copy(matrix)
+        self.results = results
+        self.move_delay = 1.0 / move_rate if move_rate else 0.0
+        self.searches_per_move = searches_per_move
+        self.search_length = search_length
+        self.rng = default_stream().spawn(1)[0]
+        self.cancelled = threading.Event()
+        self.unpaused = threading.Event()
+        self.unpaused.set()
+
+    def run(self):
+        while not self.cancelled.is_set():
+            self.unpaused.wait()
+            if self.cancelled.is_set():
+                break
+            matrix, valid_game = game_ai.ai_move(self.matrix, self.searches_per_move,
+                                                 self.search_length, rng=self.rng)
+            if valid_game:
+                matrix = game_functions.add_new_tile(matrix, self.rng)
+            self.results.put((matrix, valid_game))
+            if not valid_game:
+                break
+            self.matrix = matrix
+            if self.move_delay:
+                self.cancelled.wait(self.move_delay)
+
+    @property
+    def paused(self):
+        return not self.unpaused.is_set()
+
+    def pause(self):
+        self.unpaused.clear()
+
+    def resume(self):
+        self.unpaused.set()
+
+    def cancel(self):
+        self.cancelled.set()
+        self.unpaused.set()
+
+
 class Display(Frame):
-    def __init__(self):
+    def __init__(self, move_rate=AI_MOVE_RATE, rows=CELL_COUNT, cols=CELL_COUNT):
         Frame.__init__(self)
 
         self.grid()
@@ -47,6 +107,14 @@ class Display(Frame):
                          }
 
         self.grid_cells = []
+        self.drawn_matrix = None
+        self.last_draw_time = 0.0
+        self.redraw_pending = False
+        self.move_rate = move_rate
+        self.rows = rows
+        self.cols = cols
+        self.ai_worker = None
+        self.ai_results = queue.Queue()
         self.build_grid()
         self.init_matrix()
         self.draw_grid_cells()
@@ -58,12 +126,13 @@ class Display(Frame):
                            width=EDGE_LENGTH, height=EDGE_LENGTH)
         background.grid()
 
-        for row in range(CELL_COUNT):
+        cell_length = EDGE_LENGTH / max(self.rows, self.cols)
+        for row in range(self.rows):
             grid_row = []
-            for col in range(CELL_COUNT):
+            for col in range(self.cols):
                 cell = Frame(background, bg=EMPTY_COLOR,
-                             width=EDGE_LENGTH / CELL_COUNT,
-                             height=EDGE_LENGTH / CELL_COUNT)
+                             width=cell_length,
+                             height=cell_length)
                 cell.grid(row=row, column=col, padx=CELL_PAD,
                           pady=CELL_PAD)
                 t = Label(master=cell, text="",
@@ -75,45 +144,103 @@ class Display(Frame):
             self.grid_cells.append(grid_row)
 
     def init_matrix(self):
-        self.matrix = game_functions.initialize_game()
+        self.matrix = game_functions.initialize_game(rows=self.rows, cols=self.cols)
 
     def draw_grid_cells(self):
-        for row in range(CELL_COUNT):
-            for col in range(CELL_COUNT):
-                tile_value = self.matrix[row][col]
-                if not tile_value:
-                    self.grid_cells[row][col].configure(
-                        text="", bg=EMPTY_COLOR)
-                else:
-                    self.grid_cells[row][col].configure(text=str(
-                        tile_value), bg=TILE_COLORS[tile_value],
-                        fg=LABEL_COLORS[tile_value])
+        if self.drawn_matrix is None:
+            changed = np.ndindex(self.matrix.shape)
+        else:
+            changed = np.argwhere(self.matrix != self.drawn_matrix)
+        for row, col in changed:
+            tile_value = self.matrix[row][col]
+            if not tile_value:
+                self.grid_cells[row][col].configure(
+                    text="", bg=EMPTY_COLOR)
+            else:
+                self.grid_cells[row][col].configure(text=str(
+                    tile_value), bg=TILE_COLORS.get(tile_value, "#000000"),
+                    fg=LABEL_COLORS.get(tile_value, "#f2f2f0"))
+        self.drawn_matrix = np.array(self.matrix, copy=True)
+        self.last_draw_time = time.perf_counter()
         self.update_idletasks()
 
+    def request_redraw(self):
+        # At most one redraw per frame interval; a burst of moves inside one
+        # interval is drawn once, showing only the latest matrix.
+        wait_ms = FRAME_INTERVAL_MS - (time.perf_counter() - self.last_draw_time) * 1000
+        if wait_ms <= 0:
+            self.draw_grid_cells()
+        elif not self.redraw_pending:
+            self.redraw_pending = True
+            self.after(int(wait_ms) + 1, self.flush_redraw)
+
+    def flush_redraw(self):
+        self.redraw_pending = False
+        self.draw_grid_cells()
+
+    def start_ai_play(self):
+        self.ai_worker = AIWorker(self.matrix, self.ai_results, self.move_rate)
+        self.ai_worker.start()
+        self.after(AI_POLL_INTERVAL_MS, self.drain_ai_results)
+
+    def drain_ai_results(self):
+        worker = self.ai_worker
+        if worker is None:
+            return
+        updated = False
+        while True:
+            try:
+                matrix, valid_game = self.ai_results.get_nowait()
+            except queue.Empty:
+                break
+            if valid_game:
+                self.matrix = matrix
+                updated = True
+        if updated:
+            self.request_redraw()
+        if worker.is_alive() or not self.ai_results.empty():
+            self.after(AI_POLL_INTERVAL_MS, self.drain_ai_results)
+        else:
+            self.ai_worker = None
+
     def key_press(self, event):
-        valid_game = True
         key = repr(event.char)
+        if self.ai_worker is not None:
+            if key == AI_PLAY_KEY:
+                if self.ai_worker.paused:
+                    self.ai_worker.resume()
+                else:
+                    self.ai_worker.pause()
+            elif key == AI_CANCEL_KEY:
+                self.ai_worker.cancel()
+            return
+
         if key == AI_PLAY_KEY:
-            move_count = 0
-            while valid_game:
-                self.matrix, valid_game = game_ai.ai_move(self.matrix, 40, 30)
-                if valid_game:
-                    self.matrix = game_functions.add_new_tile(self.matrix)
-                    self.draw_grid_cells()
-                move_count += 1
-        if key == AI_KEY:
+            self.start_ai_play()
+        elif key == AI_KEY:
             self.matrix, move_made = game_ai.ai_move(self.matrix, 20, 30)
             if move_made:
                 self.matrix = game_functions.add_new_tile(self.matrix)
-                self.draw_grid_cells()
+                self.request_redraw()
                 move_made = False
 
         elif key in self.commands:
             self.matrix, move_made, _ = self.commands[repr(event.char)](self.matrix)
             if move_made:
                 self.matrix = game_functions.add_new_tile(self.matrix)
-                self.draw_grid_cells()
+                self.request_redraw()
                 move_made = False
 
 
-gamegrid = Display()
\ No newline at end of file
+def main(move_rate=AI_MOVE_RATE, rows=CELL_COUNT, cols=CELL_COUNT):
+    return Display(move_rate, rows, cols)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play 2048 in a Tk window")
+    parser.add_argument("--rows", type=int, default=CELL_COUNT)
+    parser.add_argument("--cols", type=int, default=CELL_COUNT)
+    parser.add_argument("--move-rate", type=float, default=AI_MOVE_RATE,
+                        help="AI play moves per second (0 for no delay)")
+    args = parser.parse_args()
+    main(args.move_rate, args.rows, args.cols)
@@ -1,19 +1,27 @@
 import numpy as np
 
+import bitboard
+import board_engine
+from random_stream import default_stream
+
 POSSIBLE_MOVES_COUNT = 4
 CELL_COUNT = 4
 NUMBER_OF_SQUARES = CELL_COUNT * CELL_COUNT
 NEW_TILE_DISTRIBUTION = np.array([2, 2, 2, 2, 2, 2, 2, 2, 2, 4])
 
 
-def initialize_game():
-    board = np.zeros((NUMBER_OF_SQUARES), dtype="int")
-    initial_twos = np.random.default_rng().choice(NUMBER_OF_SQUARES, 2, replace=False)
+def initialize_game(rng=None, rows=CELL_COUNT, cols=CELL_COUNT):
+    if rng is None:
+        rng = default_stream()
+    board = np.zeros((rows * cols), dtype="int")
+    initial_twos = rng.generator.choice(rows * cols, 2, replace=False)
     board[initial_twos] = 2
-    board = board.reshape((CELL_COUNT, CELL_COUNT))
+    board = board.reshape((rows, cols))
     return board
 
 
+# The original NumPy move engine, kept as the reference the packed bitboard
+# moves are tested against (tests/test_bitboard.py).
 def push_board_right(board):
     new = np.zeros((CELL_COUNT, CELL_COUNT), dtype="int")
     done = False
@@ -41,42 +49,47 @@ def merge_elements(board):
     return (board, done, score)
 
 
+def is_packable(board):
+    # 4x4 boards whose tiles fit a nibble take the packed bitboard path.
+    return np.shape(board)[-2:] == (CELL_COUNT, CELL_COUNT) \
+        and np.max(board, initial=0) < 1 << bitboard.MAX_EXPONENT
+
+
+def _packed_move(packed_move, direction, board):
+    if not is_packable(board):
+        rows, cols = np.shape(board)
+        new_board, move_made, score = board_engine.engine(rows, cols).move(
+            board_engine.exponents_of(board), direction)
+        return board_engine.tiles_of(new_board), move_made, score
+    new_packed, move_made, score = packed_move(bitboard.pack_board(board))
+    return bitboard.unpack_board(new_packed), move_made, score
+
+
 def move_up(board):
-    rotated_board = np.rot90(board, -1)
-    pushed_board, has_pushed = push_board_right(rotated_board)
-    merged_board, has_merged, score = merge_elements(pushed_board)
-    second_pushed_board, _ = push_board_right(merged_board)
-    rotated_back_board = np.rot90(second_pushed_board)
-    move_made = has_pushed or has_merged
-    return rotated_back_board, move_made, score
+    return _packed_move(bitboard.move_up, bitboard.UP, board)
 
 
 def move_down(board):
-    board = np.rot90(board)
-    board, has_pushed = push_board_right(board)
-    board, has_merged, score = merge_elements(board)
-    board, _ = push_board_right(board)
-    board = np.rot90(board, -1)
-    move_made = has_pushed or has_merged
-    return board, move_made, score
+    return _packed_move(bitboard.move_down, bitboard.DOWN, board)
 
 
 def move_left(board):
-    board = np.rot90(board, 2)
-    board, has_pushed = push_board_right(board)
-    board, has_merged, score = merge_elements(board)
-    board, _ = push_board_right(board)
-    board = np.rot90(board, -2)
-    move_made = has_pushed or has_merged
-    return board, move_made, score
+    return _packed_move(bitboard.move_left, bitboard.LEFT, board)
 
 
 def move_right(board):
-    board, has_pushed = push_board_right(board)
-    board, has_merged, score = merge_elements(board)
-    board, _ = push_board_right(board)
-    move_made = has_pushed or has_merged
-    return board, move_made, score
+    return _packed_move(bitboard.move_right, bitboard.RIGHT, board)
+
+
+def move_batch(boards, directions):
+    if not is_packable(boards):
+        rows, cols = np.shape(boards)[-2:]
+        new_boards, moved, scores = board_engine.engine(rows, cols).move_boards(
+            board_engine.exponents_of(boards), directions)
+        return board_engine.tiles_of(new_boards), moved, scores
+    packed = bitboard.pack_boards(boards)
+    new_packed, moved, scores = bitboard.move_boards(packed, directions)
+    return bitboard.unpack_boards(new_packed), moved, scores
 
 
 def fixed_move(board):
@@ -88,24 +101,37 @@ def fixed_move(board):
     return board, False
 
 
-def random_move(board):
-    move_made = False
-    move_order = [move_right, move_up, move_down, move_left]
-    while not move_made and len(move_order) > 0:
-        move_index = np.random.randint(0, len(move_order))
-        move = move_order[move_index]
-        board, move_made, score = move(board)
-        if move_made:
-            return board, True, score
-        move_order.pop(move_index)
-    return board, False, score
-
-
-def add_new_tile(board):
-    tile_value = NEW_TILE_DISTRIBUTION[np.random.randint(0, len(NEW_TILE_DISTRIBUTION))]
-    tile_row_options, tile_col_options = np.nonzero(np.logical_not(board))
-    tile_loc = np.random.randint(0, len(tile_row_options))
-    board[tile_row_options[tile_loc], tile_col_options[tile_loc]] = tile_value
+def random_move(board, rng=None):
+    if not is_packable(board):
+        rows, cols = np.shape(board)
+        new_boards, valid, scores = board_engine.engine(rows, cols).random_moves(
+            board_engine.exponents_of(board), rng)
+        if not valid[0]:
+            return board, False, 0
+        return board_engine.tiles_of(new_boards[0]), True, int(scores[0])
+    new_packed, move_made, score = bitboard.random_move(bitboard.pack_board(board), rng)
+    if not move_made:
+        return board, False, score
+    return bitboard.unpack_board(new_packed), True, score
+
+
+def legal_moves(board):
+    if not is_packable(board):
+        rows, cols = np.shape(board)
+        return board_engine.engine(rows, cols).legal_move_masks(board_engine.exponents_of(board))[0]
+    mask = bitboard.legal_moves(bitboard.pack_board(board))
+    return np.array([bool(mask >> move_index & 1) for move_index in range(POSSIBLE_MOVES_COUNT)])
+
+
+def add_new_tile(board, rng=None):
+    # Spawns in place, as before; a full board is returned unchanged.
+    if not is_packable(board):
+        rows, cols = np.shape(board)
+        spawned = board_engine.tiles_of(board_engine.engine(rows, cols).add_new_tiles(
+            board_engine.exponents_of(board), rng)[0])
+    else:
+        spawned = bitboard.unpack_board(bitboard.add_new_tile(bitboard.pack_board(board), rng))
+    board[...] = spawned
     return board
 
 
@@ -0,0 +1,179 @@
+import os
+
+import numpy as np
+
+import bitboard
+
+# A record set is two files. <path> holds a header and then one fixed-size
+# step per move, games back to back. <path>.idx holds one entry per finished
+# game pointing at its first step, so a reader can jump to any game or
+# position through memory maps without parsing anything.
+
+MAGIC = b"G2048REC"
+VERSION = 1
+HEADER_DTYPE = np.dtype([("magic", "S8"), ("version", "<u4"), ("reserved", "<u4")])
+STEP_DTYPE = np.dtype([
+    ("board", "<u8"),
+    ("move", "u1"),
+    ("spawn_cell", "u1"),
+    ("spawn_exponent", "u1"),
+    ("reserved", "u1"),
+    ("score", "<u4"),
+])
+GAME_DTYPE = np.dtype([
+    ("seed", "<u8"),
+    ("first_step", "<u8"),
+    ("step_count", "<u4"),
+    ("score", "<u4"),
+    ("final_board", "<u8"),
+])
+INDEX_SUFFIX = ".idx"
+NO_SPAWN = 0xFF
+
+
+class RecordFormatError(ValueError):
+    pass
+
+
+def spawn_of(moved_board, spawned_board):
+    added = moved_board ^ spawned_board
+    if not added:
+        return NO_SPAWN, 0
+    cell = (added.bit_length() - 1) // bitboard.CELL_BITS
+    return cell, added >> (bitboard.CELL_BITS * cell)
+
+
+def make_step(board, move, moved_board, spawned_board, score):
+    spawn_cell, spawn_exponent = spawn_of(moved_board, spawned_board)
+    return board, move, spawn_cell, spawn_exponent, 0, score
+
+
+def _header():
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header["magic"] = MAGIC
+    header["version"] = VERSION
+    return header.tobytes()
+
+
+def _check_header(path):
+    with open(path, "rb") as data:
+        raw = data.read(HEADER_DTYPE.itemsize)
+    if len(raw) < HEADER_DTYPE.itemsize:
+        raise RecordFormatError(f"{path}: truncated header")
+    header = np.frombuffer(raw, dtype=HEADER_DTYPE)[0]
+    if header["magic"] != MAGIC:
+        raise RecordFormatError(f"{path}: not a game record file")
+    if header["version"] != VERSION:
+        raise RecordFormatError(f"{path}: unsupported version {header['version']}")
+
+
+def _map(path, dtype, offset=0):
+    count = max(0, (os.path.getsize(path) - offset) // dtype.itemsize)
+    if not count:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+
+
+class GameRecordWriter:
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path) or not os.path.getsize(path):
+            with open(path, "wb") as data:
+                data.write(_header())
+        else:
+            _check_header(path)
+        self.data = open(path, "ab")
+        self.index = open(path + INDEX_SUFFIX, "ab")
+        self.step_count = (os.path.getsize(path) - HEADER_DTYPE.itemsize) // STEP_DTYPE.itemsize
+        self.seed = None
+        self.steps = []
+
+    def begin_game(self, seed):
+        self.seed = seed
+        self.steps = []
+
+    def add_step(self, board, move, moved_board, spawned_board, score):
+        self.steps.append(make_step(board, move, moved_board, spawned_board, score))
+
+    def end_game(self, final_board):
+        self.write_game(self.seed, np.array(self.steps, dtype=STEP_DTYPE), final_board)
+        self.seed = None
+        self.steps = []
+
+    def write_game(self, seed, steps, final_board):
+        # Steps go first so the index never points past data on disk.
+        steps = np.asarray(steps, dtype=STEP_DTYPE)
+        game = np.array([(seed, self.step_count, len(steps), int(steps["score"].sum()),
+                          final_board)], dtype=GAME_DTYPE)
+        self.data.write(steps.tobytes())
+        self.data.flush()
+        self.index.write(game.tobytes())
+        self.index.flush()
+        self.step_count += len(steps)
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class GameRecordReader:
+    def __init__(self, path):
+        _check_header(path)
+        self.path = path
+        self.steps = _map(path, STEP_DTYPE, HEADER_DTYPE.itemsize)
+        self.games = _map(path + INDEX_SUFFIX, GAME_DTYPE)
+        if len(self.games):
+            # Steps past the last indexed game belong to an unfinished write.
+            last = self.games[-1]
+            self.steps = self.steps[:int(last["first_step"]) + int(last["step_count"])]
+
+    def __len__(self):
+        return len(self.games)
+
+    @property
+    def position_count(self):
+        return len(self.steps)
+
+    def game(self, index):
+        game = self.games[index]
+        first = int(game["first_step"])
+        return game, self.steps[first:first + int(game["step_count"])]
+
+    def __iter__(self):
+        for index in range(len(self.games)):
+            yield self.game(index)
+
+    def game_of(self, position):
+        return int(np.searchsorted(self.games["first_step"], position, side="right")) - 1
+
+    def iter_positions(self, chunk_size=1 << 16):
+        for start in range(0, len(self.steps), chunk_size):
+            yield self.steps[start:start + chunk_size]
+
+    def unique_positions(self, chunk_size=1 << 20):
+        # Distinct positions up to symmetry, as sorted canonical boards.
+        uniques = [np.unique(bitboard.canonical_boards(chunk["board"])[0])
+                   for chunk in self.iter_positions(chunk_size)]
+        if not uniques:
+            return np.empty(0, dtype=np.uint64)
+        return np.unique(np.concatenate(uniques))
+
+    def replay(self, index):
+        # Rebuilds every board of a game from its first board, moves and spawns.
+        game, steps = self.game(index)
+        if not len(steps):
+            return [int(game["final_board"])]
+        board = int(steps[0]["board"])
+        boards = [board]
+        for step in steps:
+            board, _, _ = bitboard.MOVES[int(step["move"])](board)
+            if step["spawn_cell"] != NO_SPAWN:
+                board |= int(step["spawn_exponent"]) << (bitboard.CELL_BITS * int(step["spawn_cell"]))
+            boards.append(board)
+        return boards
@@ -0,0 +1,330 @@
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+
+import numpy as np
+
+import bitboard
+import expectimax
+import game_ai
+from random_stream import RandomStream
+from transposition import TranspositionTable
+
+# A small JSON-over-HTTP server hosting many 2048 games in one process.
+#
+#   POST   /games            {"seed": int}                 -> new game state
+#   GET    /games/<id>                                     -> game state
+#   POST   /games/<id>/move  {"move": "left"}              -> state after the move
+#   POST   /games/<id>/ai    {"strategy": ..., "apply": b} -> suggested move
+#   DELETE /games/<id>
+#
+# A session is a packed board, its own random stream and a few counters, so a
+# seeded game replays the same spawns however other games interleave. AI
+# searches run in a process pool, so the event loop keeps serving other
+# sessions meanwhile.
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8048
+MOVE_NAMES = ("left", "up", "down", "right")
+STRATEGIES = ("rollout", "expectimax")
+MAX_SESSIONS = 100000
+SESSION_TIMEOUT = 3600.0
+SWEEP_INTERVAL = 60.0
+MAX_BODY_BYTES = 1 << 16
+MAX_SEARCHES_PER_MOVE = 1000
+MAX_SEARCH_LENGTH = 100
+MAX_DEPTH = 4
+WORKER_TABLE_BYTES = 16 * 1024 * 1024
+# Sessions draw a few numbers per move; a small buffer keeps each one light.
+SESSION_BUFFER_SIZE = 64
+
+GAME_PATH = re.compile(r"^/games/(\d+)(/move|/ai)?$")
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Session:
+    __slots__ = ("board", "rng", "score", "moves", "last_active")
+
+    def __init__(self, board, rng):
+        self.board = board
+        self.rng = rng
+        self.score = 0
+        self.moves = 0
+        self.last_active = time.monotonic()
+
+
+_searchers = {}
+
+
+def _expectimax_searcher(depth):
+    # One searcher per depth and worker process, so its transposition table
+    # stays warm across requests.
+    if depth not in _searchers:
+        _searchers[depth] = expectimax.ExpectimaxSearch(
+            depth=depth, transposition_table=TranspositionTable(WORKER_TABLE_BYTES))
+    return _searchers[depth]
+
+
+def search_move(board, strategy, searches_per_move, search_length, depth, seed_sequence):
+    if strategy == "expectimax":
+        _, values = _expectimax_searcher(depth).best_move(board)
+        scores = [-np.inf if value is None else value for value in values]
+    else:
+        scores = game_ai.batch_rollout_scores(board, searches_per_move, search_length,
+                                              RandomStream(seed_sequence))
+    scores = game_ai.mask_illegal_moves(board, scores)
+    return int(np.argmax(scores)), [None if score == -np.inf else float(score)
+                                    for score in scores]
+
+
+def _integer(body, name, default, low, high):
+    value = body.get(name, default)
+    if not isinstance(value, int) or isinstance(value, bool) or not low <= value <= high:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"{name} must be an integer in [{low}, {high}]")
+    return value
+
+
+class GameServer:
+    def __init__(self, workers=None, seed=None, max_sessions=MAX_SESSIONS,
+                 session_timeout=SESSION_TIMEOUT):
+        self.sessions = {}
+        self.session_ids = itertools.count(1)
+        self.rng = RandomStream(seed)
+        self.workers = workers
+        self.pool = None
+        self.max_sessions = max_sessions
+        self.session_timeout = session_timeout
+
+    def session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"no game {session_id}")
+        session.last_active = time.monotonic()
+        return session
+
+    def state(self, session_id, session):
+        legal = bitboard.legal_moves(session.board)
+        return {
+            "id": session_id,
+            "board": bitboard.unpack_board(session.board).tolist(),
+            "score": session.score,
+            "moves": session.moves,
+            "max_tile": bitboard.max_tile(session.board),
+            "legal_moves": [MOVE_NAMES[move_index] for move_index in bitboard.LEGAL_MOVE_LISTS[legal]],
+            "over": not legal,
+        }
+
+    def new_game(self, body):
+        if len(self.sessions) >= self.max_sessions:
+            raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "too many games")
+        if body.get("seed") is None:
+            rng = self.rng.spawn(1, SESSION_BUFFER_SIZE)[0]
+        else:
+            rng = RandomStream(_integer(body, "seed", 0, 0, 2 ** 63), SESSION_BUFFER_SIZE)
+        session_id = next(self.session_ids)
+        self.sessions[session_id] = Session(bitboard.new_packed_game(rng), rng)
+        return HTTPStatus.CREATED, self.state(session_id, self.sessions[session_id])
+
+    def apply_move(self, session, move_index):
+        new_board, moved, score = bitboard.MOVES[move_index](session.board)
+        if moved:
+            session.board = bitboard.add_new_tile(new_board, session.rng)
+            session.score += score
+            session.moves += 1
+        return moved, score
+
+    def move(self, session_id, body):
+        session = self.session(session_id)
+        move = body.get("move")
+        if move in MOVE_NAMES:
+            move = MOVE_NAMES.index(move)
+        if not isinstance(move, int) or isinstance(move, bool) or not 0 <= move < len(MOVE_NAMES):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"move must be one of {MOVE_NAMES}")
+        moved, score = self.apply_move(session, move)
+        return HTTPStatus.OK, dict(self.state(session_id, session), moved=moved, move_score=score)
+
+    async def ai_move(self, session_id, body):
+        session = self.session(session_id)
+        strategy = body.get("strategy", "rollout")
+        if strategy not in STRATEGIES:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"strategy must be one of {STRATEGIES}")
+        searches_per_move = _integer(body, "searches_per_move", game_ai.SPM_SCALE_PARAM, 1,
+                                     MAX_SEARCHES_PER_MOVE)
+        search_length = _integer(body, "search_length", game_ai.SL_SCALE_PARAM, 1,
+                                 MAX_SEARCH_LENGTH)
+        depth = _integer(body, "depth", expectimax.SEARCH_DEPTH, 1, MAX_DEPTH)
+        board = session.board
+        if not bitboard.legal_moves(board):
+            raise HTTPError(HTTPStatus.CONFLICT, "game is over")
+        seed_sequence = session.rng.seed_sequence.spawn(1)[0]
+        move_index, scores = await asyncio.get_running_loop().run_in_executor(
+            self.start_pool(), search_move, board, strategy, searches_per_move, search_length,
+            depth, seed_sequence)
+        result = {"move": MOVE_NAMES[move_index], "scores": scores}
+        if body.get("apply"):
+            # Another request may have moved this game while the search ran.
+            if self.sessions.get(session_id) is not session or session.board != board:
+                raise HTTPError(HTTPStatus.CONFLICT, "game changed during the search")
+            moved, score = self.apply_move(session, move_index)
+            result.update(self.state(session_id, session), moved=moved, move_score=score)
+        return HTTPStatus.OK, result
+
+    def delete(self, session_id):
+        self.session(session_id)
+        del self.sessions[session_id]
+        return HTTPStatus.NO_CONTENT, None
+
+    async def route(self, method, path, body):
+        if path == "/games":
+            if method == "POST":
+                return self.new_game(body)
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} not allowed")
+        match = GAME_PATH.match(path)
+        if not match:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"no route for {path}")
+        session_id = int(match.group(1))
+        action = match.group(2)
+        if action is None and method == "GET":
+            return HTTPStatus.OK, self.state(session_id, self.session(session_id))
+        if action is None and method == "DELETE":
+            return self.delete(session_id)
+        if action == "/move" and method == "POST":
+            return self.move(session_id, body)
+        if action == "/ai" and method == "POST":
+            return await self.ai_move(session_id, body)
+        raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} not allowed")
+
+    async def read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, _ = request_line.decode("latin-1").split()
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "malformed request line")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length", 0) or 0)
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "malformed Content-Length")
+        if length < 0:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "malformed Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "body too large")
+        body = {}
+        if length:
+            try:
+                body = json.loads(await reader.readexactly(length))
+            except ValueError:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "body must be JSON")
+            if not isinstance(body, dict):
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "body must be a JSON object")
+        keep_alive = headers.get("connection", "").lower() != "close"
+        return method, target.split("?", 1)[0], body, keep_alive
+
+    async def handle_connection(self, reader, writer):
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    request = await self.read_request(reader)
+                    if request is None:
+                        break
+                    method, path, body, keep_alive = request
+                    status, payload = await self.route(method, path, body)
+                except HTTPError as error:
+                    status, payload = error.status, {"error": error.message}
+                    keep_alive = keep_alive and error.status != HTTPStatus.BAD_REQUEST
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    raise
+                except Exception as error:
+                    # A failed search (a broken pool, say) still gets an answer.
+                    status = HTTPStatus.INTERNAL_SERVER_ERROR
+                    payload = {"error": f"{type(error).__name__}: {error}"}
+                    keep_alive = False
+                content = b"" if payload is None else json.dumps(payload).encode()
+                writer.write(f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                             f"Content-Type: application/json\r\n"
+                             f"Content-Length: {len(content)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                             .encode("latin-1") + content)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def sweep_sessions(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            cutoff = time.monotonic() - self.session_timeout
+            for session_id in [session_id for session_id, session in self.sessions.items()
+                               if session.last_active < cutoff]:
+                del self.sessions[session_id]
+
+    def start_pool(self):
+        # Workers must not inherit the server's sockets: a plain fork would
+        # keep closed connections from sending their FIN and keep the port
+        # bound after the server dies. A fork server is exec'd with only its
+        # own pipes, so its children start clean.
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(
+                    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods()
+                    else "spawn"))
+        return self.pool
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None):
+        self.start_pool()
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle_connection, unix_path)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+        sweeper = asyncio.create_task(self.sweep_sessions())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            sweeper.cancel()
+            if self.pool is not None:
+                self.pool.shutdown(cancel_futures=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless multi-session 2048 game server")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", help="listen on this Unix socket instead of TCP")
+    parser.add_argument("--workers", type=int, help="AI search processes (default: CPU count)")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--max-sessions", type=int, default=MAX_SESSIONS)
+    args = parser.parse_args()
+
+    server = GameServer(args.workers, args.seed, args.max_sessions)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
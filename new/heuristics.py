@@ -0,0 +1,158 @@
+import numpy as np
+
+import bitboard
+
+# Every feature is tabulated per packed 16-bit row. Row-symmetric features
+# (empty, merges, monotonicity, smoothness) are scored on the four rows and the
+# four columns of the transposed board; positional features (corner, snake)
+# depend on the row index and are folded into that row's table. A board then
+# evaluates in eight lookups.
+
+HEURISTIC_BASE = 200000.0
+# What a lost board is worth to evaluators that do not set game_over_value;
+# it has to sit below anything they return, or a search prefers losing.
+GAME_OVER_VALUE = -1e9
+MONOTONICITY_POWER = 4
+
+DEFAULT_WEIGHTS = {
+    "empty": 270.0,
+    "merges": 700.0,
+    "monotonicity": 47.0,
+    "smoothness": 10.0,
+    "corner": 0.0,
+    "snake": 0.0,
+}
+LINE_FEATURES = ("empty", "merges", "monotonicity", "smoothness")
+POSITIONAL_FEATURES = ("corner", "snake")
+
+CORNER_WEIGHTS = np.array([[6, 5, 4, 3],
+                           [5, 4, 3, 2],
+                           [4, 3, 2, 1],
+                           [3, 2, 1, 0]]) / 6.0
+SNAKE_ORDER = np.array([[0, 1, 2, 3],
+                        [7, 6, 5, 4],
+                        [8, 9, 10, 11],
+                        [15, 14, 13, 12]])
+SNAKE_WEIGHTS = np.power(0.5, SNAKE_ORDER)
+
+
+def _row_exponents():
+    rows = np.arange(bitboard.TABLE_SIZE)
+    return np.stack([(rows >> (bitboard.CELL_BITS * i)) & bitboard.CELL_MASK
+                     for i in range(bitboard.ROW_COUNT)], axis=1)
+
+
+def empty_table(exponents):
+    return (exponents == 0).sum(axis=1).astype(float)
+
+
+def merges_table(exponents):
+    # Counts tiles that could merge once gaps close: a run of k equal
+    # non-empty tiles contributes k.
+    order = np.argsort(exponents == 0, axis=1, kind="stable")
+    packed = np.take_along_axis(exponents, order, axis=1)
+    merges = np.zeros(len(exponents))
+    run = np.zeros(len(exponents))
+    for col in range(1, bitboard.ROW_COUNT):
+        same = (packed[:, col] == packed[:, col - 1]) & (packed[:, col] != 0)
+        ended = ~same & (run > 0)
+        merges += np.where(ended, run + 1, 0)
+        run = np.where(same, run + 1, 0)
+    return merges + np.where(run > 0, run + 1, 0)
+
+
+def monotonicity_table(exponents):
+    # Penalty: the smaller of the increasing and decreasing power sums.
+    powered = exponents.astype(float) ** MONOTONICITY_POWER
+    steps = powered[:, :-1] - powered[:, 1:]
+    decreasing = np.where(steps > 0, steps, 0).sum(axis=1)
+    increasing = np.where(steps < 0, -steps, 0).sum(axis=1)
+    return -np.minimum(decreasing, increasing)
+
+
+def smoothness_table(exponents):
+    filled = (exponents[:, :-1] != 0) & (exponents[:, 1:] != 0)
+    return -np.where(filled, np.abs(exponents[:, :-1] - exponents[:, 1:]), 0).sum(axis=1)
+
+
+def positional_table(exponents, row_weights):
+    values = np.where(exponents > 0, np.left_shift(1, exponents), 0)
+    return (values * row_weights).sum(axis=1)
+
+
+LINE_TABLES = {
+    "empty": empty_table,
+    "merges": merges_table,
+    "monotonicity": monotonicity_table,
+    "smoothness": smoothness_table,
+}
+POSITIONAL_WEIGHTS = {
+    "corner": CORNER_WEIGHTS,
+    "snake": SNAKE_WEIGHTS,
+}
+
+
+class Evaluator:
+    def __init__(self, weights=None, base=HEURISTIC_BASE):
+        self.weights = dict(DEFAULT_WEIGHTS)
+        if weights:
+            unknown = set(weights) - set(DEFAULT_WEIGHTS)
+            if unknown:
+                raise ValueError(f"unknown heuristic weights: {sorted(unknown)}")
+            self.weights.update(weights)
+        exponents = _row_exponents()
+        line = np.zeros(bitboard.TABLE_SIZE)
+        for name in LINE_FEATURES:
+            if self.weights[name]:
+                line += self.weights[name] * LINE_TABLES[name](exponents)
+        row_tables = []
+        for row in range(bitboard.ROW_COUNT):
+            table = line + base / bitboard.ROW_COUNT
+            for name in POSITIONAL_FEATURES:
+                if self.weights[name]:
+                    table = table + self.weights[name] * positional_table(
+                        exponents, POSITIONAL_WEIGHTS[name][row])
+            row_tables.append(table)
+        # Without positional features every row and column is scored alike, so
+        # all eight symmetries of a board evaluate the same.
+        self.symmetric = not any(self.weights[name] for name in POSITIONAL_FEATURES)
+        self.row_tables = np.stack(row_tables)
+        # The features can push a live board far below zero, so a lost board
+        # is scored a full base under the lowest value any board can reach.
+        self.game_over_value = float(self.row_tables.min(axis=1).sum()
+                                     + bitboard.ROW_COUNT * line.min()) - base
+        self.column_table = line
+        self._rows = [table.tolist() for table in row_tables]
+        self._columns = line.tolist()
+
+    def __call__(self, board):
+        rows = self._rows
+        columns = self._columns
+        t = bitboard.transpose(board)
+        return (rows[0][board & 0xFFFF] + rows[1][(board >> 16) & 0xFFFF]
+                + rows[2][(board >> 32) & 0xFFFF] + rows[3][board >> 48]
+                + columns[t & 0xFFFF] + columns[(t >> 16) & 0xFFFF]
+                + columns[(t >> 32) & 0xFFFF] + columns[t >> 48])
+
+    def evaluate_boards(self, boards):
+        boards = np.asarray(boards, dtype=np.uint64)
+        mask = np.uint64(bitboard.ROW_MASK)
+        rows = ((boards[:, None] >> bitboard.ROW_SHIFTS) & mask).astype(np.intp)
+        columns = ((bitboard.transpose_boards(boards)[:, None] >> bitboard.ROW_SHIFTS)
+                   & mask).astype(np.intp)
+        row_values = self.row_tables[np.arange(bitboard.ROW_COUNT), rows]
+        return row_values.sum(axis=1) + self.column_table[columns].sum(axis=1)
+
+
+def game_over_value(evaluator):
+    return getattr(evaluator, "game_over_value", GAME_OVER_VALUE)
+
+
+_default_evaluator = None
+
+
+def default_evaluator():
+    global _default_evaluator
+    if _default_evaluator is None:
+        _default_evaluator = Evaluator()
+    return _default_evaluator
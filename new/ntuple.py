@@ -0,0 +1,241 @@
+import argparse
+import os
+
+import numpy as np
+
+import bitboard
+from random_stream import default_stream
+
+# An n-tuple network values a board as a sum of weights looked up by the
+# exponents under a few fixed cell patterns. Each pattern is read from all
+# eight symmetries of the board and shares one weight table across them, so
+# the value is symmetric and a pattern learns from eight samples per board.
+# Every table lives in one flat float32 array; pattern p owns the slice
+# starting at offsets[p] with 16 ** len(pattern) entries.
+
+# Cells are row * 4 + col. Rows, 2x2 squares and their symmetric images cover
+# the board with 5 * 65536 weights; the 6-tuples play far better but need
+# 4 * 16 ** 6 weights (256 MiB).
+FOUR_TUPLE_PATTERNS = (
+    (0, 1, 2, 3),
+    (4, 5, 6, 7),
+    (0, 1, 4, 5),
+    (1, 2, 5, 6),
+    (5, 6, 9, 10),
+)
+SIX_TUPLE_PATTERNS = (
+    (0, 1, 2, 3, 4, 5),
+    (4, 5, 6, 7, 8, 9),
+    (0, 1, 2, 4, 5, 6),
+    (4, 5, 6, 8, 9, 10),
+)
+PATTERN_SETS = {"four": FOUR_TUPLE_PATTERNS, "six": SIX_TUPLE_PATTERNS}
+MAX_TUPLE_SIZE = 6
+CELL_COUNT = bitboard.ROW_COUNT * bitboard.ROW_COUNT
+
+LEARNING_RATE = 0.01
+BATCH_SIZE = 256
+REPORT_INTERVAL = 1000
+
+MAGIC = b"G2048NTN"
+VERSION = 1
+HEADER_DTYPE = np.dtype([("magic", "S8"), ("version", "<u4"), ("pattern_count", "<u4"),
+                         ("weight_count", "<u8")])
+PATTERN_DTYPE = np.dtype([("length", "u1"), ("cells", "u1", (MAX_TUPLE_SIZE,))])
+WEIGHTS_ALIGNMENT = 64
+
+
+class NTupleNetwork:
+    # Same interface as heuristics.Evaluator: call it on a packed board, or use
+    # evaluate_boards on a uint64 array.
+    symmetric = True
+
+    def __init__(self, patterns=FOUR_TUPLE_PATTERNS, weights=None):
+        patterns = tuple(tuple(int(cell) for cell in pattern) for pattern in patterns)
+        for pattern in patterns:
+            if not 1 <= len(pattern) <= MAX_TUPLE_SIZE \
+                    or not all(0 <= cell < CELL_COUNT for cell in pattern):
+                raise ValueError(f"bad n-tuple pattern {pattern}")
+        self.patterns = patterns
+        sizes = [1 << (bitboard.CELL_BITS * len(pattern)) for pattern in patterns]
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+        weight_count = int(sum(sizes))
+        if weights is None:
+            weights = np.zeros(weight_count, dtype=np.float32)
+        elif len(weights) != weight_count:
+            raise ValueError(f"expected {weight_count} weights, got {len(weights)}")
+        self.weights = weights
+        self.feature_count = len(patterns) * bitboard.SYMMETRY_COUNT
+        self._shifts = [(int(offset), [(bitboard.CELL_BITS * cell, bitboard.CELL_BITS * position)
+                                       for position, cell in enumerate(pattern)])
+                        for offset, pattern in zip(self.offsets, patterns)]
+
+    def __call__(self, board):
+        indices = []
+        for symmetric in bitboard.symmetries(board):
+            for offset, shifts in self._shifts:
+                index = offset
+                for shift, position in shifts:
+                    index |= ((symmetric >> shift) & 0xF) << position
+                indices.append(index)
+        return float(self.weights[indices].sum(dtype=np.float64))
+
+    def feature_indices(self, boards):
+        symmetric = bitboard.symmetric_boards(boards)
+        columns = []
+        for offset, shifts in self._shifts:
+            index = np.full(symmetric.shape, offset, dtype=np.int64)
+            for shift, position in shifts:
+                index |= ((symmetric >> np.uint64(shift)) & np.uint64(0xF)).astype(np.int64) \
+                    << position
+            columns.append(index)
+        return np.concatenate(columns, axis=1)
+
+    def evaluate_boards(self, boards):
+        return self.weights[self.feature_indices(boards)].sum(axis=1, dtype=np.float64)
+
+    def update(self, boards, deltas):
+        # Moves every weight the boards read by the mean delta of its readers.
+        # Summing instead would scale shared weights (empty rows, say) by the
+        # batch size and diverge.
+        indices = self.feature_indices(boards)
+        unique, inverse = np.unique(indices.ravel(), return_inverse=True)
+        sums = np.bincount(inverse, weights=np.repeat(deltas, indices.shape[1]))
+        self.weights[unique] += (sums / np.bincount(inverse)).astype(np.float32)
+
+    def save(self, path):
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header["magic"] = MAGIC
+        header["version"] = VERSION
+        header["pattern_count"] = len(self.patterns)
+        header["weight_count"] = len(self.weights)
+        patterns = np.zeros(len(self.patterns), dtype=PATTERN_DTYPE)
+        for row, pattern in zip(patterns, self.patterns):
+            row["length"] = len(pattern)
+            row["cells"][:len(pattern)] = pattern
+        metadata = header.tobytes() + patterns.tobytes()
+        padding = -len(metadata) % WEIGHTS_ALIGNMENT
+        # Written aside and renamed, so readers mapping the old file never see
+        # a half-written one.
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "wb") as output:
+            output.write(metadata + bytes(padding))
+            output.write(np.ascontiguousarray(self.weights, dtype="<f4").tobytes())
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path, mode="r"):
+        # mode is np.memmap's: "r" shares read-only pages between processes,
+        # "c" gives a private copy-on-write view to keep training from.
+        with open(path, "rb") as data:
+            header = np.frombuffer(data.read(HEADER_DTYPE.itemsize), dtype=HEADER_DTYPE)
+            if not len(header) or header[0]["magic"] != MAGIC:
+                raise ValueError(f"{path}: not an n-tuple weight file")
+            if header[0]["version"] != VERSION:
+                raise ValueError(f"{path}: unsupported version {header[0]['version']}")
+            pattern_count = int(header[0]["pattern_count"])
+            patterns = np.frombuffer(data.read(PATTERN_DTYPE.itemsize * pattern_count),
+                                     dtype=PATTERN_DTYPE)
+        metadata_size = HEADER_DTYPE.itemsize + PATTERN_DTYPE.itemsize * pattern_count
+        weights = np.memmap(path, dtype="<f4", mode=mode,
+                            offset=metadata_size + -metadata_size % WEIGHTS_ALIGNMENT,
+                            shape=(int(header[0]["weight_count"]),))
+        return cls([row["cells"][:row["length"]] for row in patterns], weights)
+
+
+def new_boards(count, rng=None):
+    return bitboard.add_new_tiles(bitboard.add_new_tiles(np.zeros(count, dtype=np.uint64), rng),
+                                  rng)
+
+
+class TDTrainer:
+    # TD(0) on afterstates, one batch of games in lockstep. Every game picks
+    # the move maximising reward + V(afterstate); the previous afterstate is
+    # then pulled towards that value, or towards 0 when the game has ended.
+    def __init__(self, network, batch_size=BATCH_SIZE, learning_rate=LEARNING_RATE, rng=None):
+        self.network = network
+        self.batch_size = batch_size
+        self.learning_rate = learning_rate
+        self.rng = default_stream() if rng is None else rng
+
+    def best_afterstates(self, boards):
+        count = len(boards)
+        afterstates, moved, scores = bitboard.move_boards(np.repeat(boards, 4),
+                                                          np.tile(np.arange(4), count))
+        values = np.where(moved, scores + self.network.evaluate_boards(afterstates), -np.inf)
+        values = values.reshape(count, 4)
+        best = values.argmax(axis=1)
+        rows = np.arange(count)
+        alive = moved.reshape(count, 4).any(axis=1)
+        return (afterstates.reshape(count, 4)[rows, best], scores.reshape(count, 4)[rows, best],
+                values[rows, best], alive)
+
+    def train(self, games, checkpoint_path=None, checkpoint_interval=None, report=None):
+        # Returns the final scores of the finished games, in finishing order.
+        boards = new_boards(self.batch_size, self.rng)
+        previous = np.zeros(self.batch_size, dtype=np.uint64)
+        has_previous = np.zeros(self.batch_size, dtype=bool)
+        game_scores = np.zeros(self.batch_size, dtype=np.int64)
+        finished = []
+        next_checkpoint = checkpoint_interval
+        while len(finished) < games:
+            afterstates, rewards, values, alive = self.best_afterstates(boards)
+            learning = np.flatnonzero(has_previous)
+            if len(learning):
+                targets = np.where(alive[learning], values[learning], 0.0)
+                errors = targets - self.network.evaluate_boards(previous[learning])
+                self.network.update(previous[learning], self.learning_rate * errors)
+
+            ended = np.flatnonzero(~alive)
+            if len(ended):
+                finished.extend(game_scores[ended].tolist())
+                boards[ended] = new_boards(len(ended), self.rng)
+                has_previous[ended] = False
+                game_scores[ended] = 0
+                if report:
+                    report(finished)
+            playing = np.flatnonzero(alive)
+            game_scores[playing] += rewards[playing]
+            previous[playing] = afterstates[playing]
+            has_previous[playing] = True
+            boards[playing] = bitboard.add_new_tiles(afterstates[playing], self.rng)
+
+            if next_checkpoint and checkpoint_path and len(finished) >= next_checkpoint:
+                self.network.save(checkpoint_path)
+                next_checkpoint += checkpoint_interval
+        if checkpoint_path:
+            self.network.save(checkpoint_path)
+        return finished
+
+
+def main():
+    from random_stream import RandomStream
+
+    parser = argparse.ArgumentParser(description="Train an n-tuple network by TD self-play")
+    parser.add_argument("output", help="weight file to write (and resume from if it exists)")
+    parser.add_argument("--games", type=int, default=10000)
+    parser.add_argument("--patterns", choices=sorted(PATTERN_SETS), default="four")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--learning-rate", type=float, default=LEARNING_RATE)
+    parser.add_argument("--checkpoint-interval", type=int, default=REPORT_INTERVAL)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    if os.path.exists(args.output):
+        network = NTupleNetwork.load(args.output, mode="c")
+    else:
+        network = NTupleNetwork(PATTERN_SETS[args.patterns])
+    trainer = TDTrainer(network, args.batch_size, args.learning_rate, RandomStream(args.seed))
+    reported = [0]
+
+    def report(finished):
+        if len(finished) // REPORT_INTERVAL > reported[0]:
+            reported[0] = len(finished) // REPORT_INTERVAL
+            print(f"{len(finished)} games, mean score of the last {REPORT_INTERVAL}: "
+                  f"{np.mean(finished[-REPORT_INTERVAL:]):.0f}")
+
+    trainer.train(args.games, args.output, args.checkpoint_interval, report)
+
+
+if __name__ == "__main__":
+    main()
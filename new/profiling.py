@@ -0,0 +1,213 @@
+import contextlib
+import cProfile
+import io
+import pstats
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+import bitboard
+import heuristics
+
+# Counters are collected by swapping timed wrappers into bitboard and
+# heuristics while at least one collect() block is open, and putting the
+# originals back when the last one closes. With no block open the engine runs
+# untouched code, so disabled instrumentation costs nothing. The wrappers are
+# shared by every thread, but each thread keeps its own stack of blocks: calls
+# are charged only to blocks opened on the calling thread.
+
+CATEGORIES = ("move", "spawn", "copy", "legality", "evaluation")
+PROFILE_LINES = 25
+
+_HOOKS = [
+    (bitboard, "move_left", "move", False),
+    (bitboard, "move_right", "move", False),
+    (bitboard, "move_up", "move", False),
+    (bitboard, "move_down", "move", False),
+    (bitboard, "move_plan", "move", False),
+    (bitboard, "random_move", "move", False),
+    (bitboard, "move_boards", "move", True),
+    (bitboard, "random_moves", "move", True),
+    (bitboard, "add_new_tile", "spawn", False),
+    (bitboard, "add_new_tiles", "spawn", True),
+    (bitboard, "pack_board", "copy", False),
+    (bitboard, "unpack_board", "copy", True),
+    (bitboard, "pack_boards", "copy", True),
+    (bitboard, "unpack_boards", "copy", True),
+    (bitboard, "legal_moves", "legality", False),
+    (bitboard, "legal_move_masks", "legality", True),
+    (heuristics.Evaluator, "__call__", "evaluation", False),
+    (heuristics.Evaluator, "evaluate_boards", "evaluation", True),
+]
+
+_originals = []
+_open_blocks = 0
+_install_lock = threading.Lock()
+_local = threading.local()
+
+
+def _thread_stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+        _local.inside = False
+    return _local.stack
+
+
+class Stats:
+    def __init__(self):
+        self.calls = dict.fromkeys(CATEGORIES, 0)
+        self.seconds = dict.fromkeys(CATEGORIES, 0.0)
+        self.arrays_returned = 0
+        self.nodes = 0
+        self.rollouts = 0
+        self.moves = 0
+        self.wall_seconds = 0.0
+        self.profile = None
+        self.memory = None
+        self.move_stats = []
+
+    def merge(self, other):
+        for category in CATEGORIES:
+            self.calls[category] += other.calls[category]
+            self.seconds[category] += other.seconds[category]
+        self.arrays_returned += other.arrays_returned
+        self.nodes += other.nodes
+        self.rollouts += other.rollouts
+        self.moves += other.moves
+
+    def per_second(self, count):
+        return count / self.wall_seconds if self.wall_seconds else 0.0
+
+    def as_dict(self):
+        return {
+            "wall_seconds": self.wall_seconds,
+            "moves": self.moves,
+            "calls": dict(self.calls),
+            "seconds": dict(self.seconds),
+            "nodes": self.nodes,
+            "nodes_per_second": self.per_second(self.nodes),
+            "rollouts": self.rollouts,
+            "rollouts_per_second": self.per_second(self.rollouts),
+            # ndarrays handed back by batch calls, not every allocation made;
+            # tracemalloc (memory=True) measures those.
+            "arrays_returned": self.arrays_returned,
+            "arrays_returned_per_move": (self.arrays_returned / self.moves
+                                         if self.moves else 0.0),
+            "memory": self.memory,
+        }
+
+    def __str__(self):
+        timings = ", ".join(f"{category} {self.calls[category]}x/{self.seconds[category] * 1000:.1f}ms"
+                            for category in CATEGORIES if self.calls[category])
+        return (f"{self.moves} moves in {self.wall_seconds * 1000:.1f}ms: {timings}; "
+                f"{self.per_second(self.nodes):.0f} nodes/s, "
+                f"{self.per_second(self.rollouts):.0f} rollouts/s, "
+                f"{self.arrays_returned} arrays returned")
+
+
+def _timed(function, category, returns_arrays):
+    def timed(*args, **kwargs):
+        # Only the outermost hooked call is charged, so random_move is not
+        # counted again for the move and legality check it makes inside.
+        stack = _thread_stack()
+        if _local.inside or not stack:
+            return function(*args, **kwargs)
+        _local.inside = True
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            _local.inside = False
+        stats = stack[-1]
+        stats.calls[category] += 1
+        stats.seconds[category] += time.perf_counter() - start
+        if returns_arrays:
+            outputs = result if isinstance(result, tuple) else (result,)
+            stats.arrays_returned += sum(isinstance(output, np.ndarray) for output in outputs)
+        return result
+
+    timed.__name__ = function.__name__
+    timed.__doc__ = function.__doc__
+    timed.__wrapped__ = function
+    return timed
+
+
+def _install():
+    for owner, name, category, returns_arrays in _HOOKS:
+        function = getattr(owner, name)
+        _originals.append((owner, name, function))
+        setattr(owner, name, _timed(function, category, returns_arrays))
+    _originals.append((bitboard, "MOVES", list(bitboard.MOVES)))
+    bitboard.MOVES[:] = [bitboard.move_left, bitboard.move_up, bitboard.move_down,
+                         bitboard.move_right]
+
+
+def _uninstall():
+    while _originals:
+        owner, name, original = _originals.pop()
+        if name == "MOVES":
+            bitboard.MOVES[:] = original
+        else:
+            setattr(owner, name, original)
+
+
+def add_work(nodes=0, rollouts=0):
+    stack = _thread_stack()
+    if stack:
+        stats = stack[-1]
+        stats.nodes += nodes
+        stats.rollouts += rollouts
+
+
+@contextlib.contextmanager
+def collect(profile=False, memory=False):
+    # A nested block's counters are added to the enclosing one on exit, so a
+    # game's stats include those of every move collected inside it.
+    global _open_blocks
+    stats = Stats()
+    with _install_lock:
+        if not _open_blocks:
+            _install()
+        _open_blocks += 1
+    stack = _thread_stack()
+    stack.append(stats)
+    profiler = cProfile.Profile() if profile else None
+    started_tracing = memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    if memory:
+        tracemalloc.reset_peak()
+        memory_start = tracemalloc.get_traced_memory()[0]
+    if profiler:
+        profiler.enable()
+    start = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        stats.wall_seconds = time.perf_counter() - start
+        if profiler:
+            profiler.disable()
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(PROFILE_LINES)
+            stats.profile = output.getvalue()
+        if memory:
+            current, peak = tracemalloc.get_traced_memory()
+            stats.memory = {"allocated_bytes": current - memory_start,
+                            "peak_bytes": peak - memory_start}
+            if started_tracing:
+                tracemalloc.stop()
+        stack.pop()
+        if stack:
+            stack[-1].merge(stats)
+        with _install_lock:
+            _open_blocks -= 1
+            if not _open_blocks:
+                _uninstall()
+
+
+def maybe_collect(enabled, profile=False, memory=False):
+    if enabled or profile or memory:
+        return collect(profile, memory)
+    return contextlib.nullcontext()
@@ -0,0 +1,48 @@
+import numpy as np
+
+BUFFER_SIZE = 4096
+
+
+class RandomStream:
+    # Wraps a NumPy Generator. Scalar draws come from a pre-drawn buffer, which
+    # is several times cheaper per call than Generator or legacy np.random.
+    __slots__ = ("seed_sequence", "generator", "buffer_size", "_buffer", "_index")
+
+    def __init__(self, seed=None, buffer_size=BUFFER_SIZE):
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed_sequence = seed
+        self.generator = np.random.default_rng(seed)
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._index = 0
+
+    def random(self):
+        index = self._index
+        if index >= len(self._buffer):
+            self._buffer = self.generator.random(self.buffer_size).tolist()
+            index = 0
+        self._index = index + 1
+        return self._buffer[index]
+
+    def below(self, count):
+        return int(self.random() * count)
+
+    def spawn(self, count, buffer_size=BUFFER_SIZE):
+        return [RandomStream(child, buffer_size) for child in self.seed_sequence.spawn(count)]
+
+
+_default_stream = None
+
+
+def default_stream():
+    global _default_stream
+    if _default_stream is None:
+        _default_stream = RandomStream()
+    return _default_stream
+
+
+def seed_default_stream(seed):
+    global _default_stream
+    _default_stream = RandomStream(seed)
+    return _default_stream
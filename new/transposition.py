@@ -0,0 +1,84 @@
+import numpy as np
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+BUCKET_SIZE = 2
+ENTRY_BYTES = 8 + 8 + 1
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+WORD_MASK = (1 << 64) - 1
+
+EMPTY_KEY = 0
+
+
+class TranspositionTable:
+    # Two-way buckets in flat arrays. A store into a full bucket replaces the
+    # shallower entry, so deep results survive; the second slot churns.
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        bucket_count = max(1, max_bytes // (ENTRY_BYTES * BUCKET_SIZE))
+        self.bucket_bits = bucket_count.bit_length() - 1
+        bucket_count = 1 << self.bucket_bits
+        self.capacity = bucket_count * BUCKET_SIZE
+        self.keys = np.zeros(self.capacity, dtype=np.uint64)
+        self.values = np.zeros(self.capacity, dtype=np.float64)
+        self.depths = np.zeros(self.capacity, dtype=np.int8)
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.values.nbytes + self.depths.nbytes
+
+    def _bucket(self, key):
+        if not self.bucket_bits:
+            return 0
+        return ((key * HASH_MULTIPLIER) & WORD_MASK) >> (64 - self.bucket_bits) << 1
+
+    def lookup(self, key, depth):
+        slot = self._bucket(key)
+        for index in (slot, slot + 1):
+            if self.keys[index] == key and self.depths[index] >= depth:
+                self.hits += 1
+                return float(self.values[index])
+        self.misses += 1
+        return None
+
+    def store(self, key, depth, value):
+        slot = self._bucket(key)
+        first_key = int(self.keys[slot])
+        second_key = int(self.keys[slot + 1])
+        if first_key == key or first_key == EMPTY_KEY:
+            index = slot
+        elif second_key == key or second_key == EMPTY_KEY:
+            index = slot + 1
+        else:
+            index = slot + 1 if self.depths[slot] > self.depths[slot + 1] else slot
+            self.evictions += 1
+        if self.keys[index] == key and self.depths[index] > depth:
+            return
+        self.keys[index] = key
+        self.depths[index] = depth
+        self.values[index] = value
+        self.stores += 1
+
+    def clear(self):
+        self.keys[:] = EMPTY_KEY
+        self.depths[:] = 0
+        self.values[:] = 0.0
+
+    def reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def stats(self):
+        return {
+            "capacity": self.capacity,
+            "bytes": self.nbytes,
+            "used": int(np.count_nonzero(self.keys)),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+        }
@@ -1,8 +1,16 @@
-import pygame
-import random
+import argparse
+import collections
 import math
+import os
+import random
+import sys
+import time
+
+import pygame
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "new"))
 
-pygame.init()
+import bitboard
 
 FPS = 60
 
@@ -18,14 +26,29 @@ OUTLINE_THICKNESS = 10
 BACKGROUND_COLOR = (205, 192, 180)
 FONT_COLOR = (119, 110, 101)
 
-FONT = pygame.font.SysFont("comicsans", 60, bold=True)
-MOVE_VEL = 20
+ANIMATION_SECONDS = 0.12
+INPUT_QUEUE_LENGTH = 4
 
-WINDOW = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("2048")
+FONT = None
+WINDOW = None
+
+
+def init_display(headless=False):
+    # Nothing touches SDL until a front end actually starts.
+    global FONT, WINDOW
+    if WINDOW is None:
+        if headless:
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
+        pygame.init()
+        FONT = pygame.font.SysFont("comicsans", 60, bold=True)
+        WINDOW = pygame.display.set_mode((WIDTH, HEIGHT))
+        pygame.display.set_caption("2048")
+    return WINDOW
 
 
 class Tile:
+    __slots__ = ("value", "row", "col", "x", "y")
+
     COLORS = [
         (237, 229, 218),
         (238, 225, 201),
@@ -46,34 +69,35 @@ class Tile:
         self.y = row * RECT_HEIGHT
 
     def get_color(self):
-        color_index = int(math.log2(self.value)) - 1
+        color_index = min(int(math.log2(self.value)) - 1, len(self.COLORS) - 1)
         color = self.COLORS[color_index]
         return color
 
     def draw(self, window):
-        color = self.get_color()
-        pygame.draw.rect(window, color, (self.x, self.y, RECT_WIDTH, RECT_HEIGHT))
+        window.blit(tile_surface(self.value), (self.x, self.y))
+
+
+_tile_surfaces = {}
+_background = None
+_grid_overlay = None
+_last_frame = None
 
-        text = FONT.render(str(self.value), 1, FONT_COLOR)
-        window.blit(
+
+def tile_surface(value):
+    surface = _tile_surfaces.get(value)
+    if surface is None:
+        surface = pygame.Surface((RECT_WIDTH, RECT_HEIGHT))
+        surface.fill(Tile(value, 0, 0).get_color())
+        text = FONT.render(str(value), 1, FONT_COLOR)
+        surface.blit(
             text,
             (
-                self.x + (RECT_WIDTH / 2 - text.get_width() / 2),
-                self.y + (RECT_HEIGHT / 2 - text.get_height() / 2),
+                RECT_WIDTH / 2 - text.get_width() / 2,
+                RECT_HEIGHT / 2 - text.get_height() / 2,
             ),
         )
-
-    def set_pos(self, ceil=False):
-        if ceil:
-            self.row = math.ceil(self.y / RECT_HEIGHT)
-            self.col = math.ceil(self.x / RECT_WIDTH)
-        else:
-            self.row = math.floor(self.y / RECT_HEIGHT)
-            self.col = math.floor(self.x / RECT_WIDTH)
-
-    def move(self, delta):
-        self.x += delta[0]
-        self.y += delta[1]
+        _tile_surfaces[value] = surface
+    return surface
 
 
 def draw_grid(window):
@@ -88,146 +112,116 @@ def draw_grid(window):
     pygame.draw.rect(window, OUTLINE_COLOR, (0, 0, WIDTH, HEIGHT), OUTLINE_THICKNESS)
 
 
-def draw(window, tiles):
-    window.fill(BACKGROUND_COLOR)
-
-    for tile in tiles.values():
-        tile.draw(window)
-
-    draw_grid(window)
+def get_background():
+    global _background
+    if _background is None:
+        _background = pygame.Surface((WIDTH, HEIGHT))
+        _background.fill(BACKGROUND_COLOR)
+    return _background
 
-    pygame.display.update()
 
+def get_grid_overlay():
+    global _grid_overlay
+    if _grid_overlay is None:
+        _grid_overlay = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
+        draw_grid(_grid_overlay)
+    return _grid_overlay
 
-def get_random_pos(tiles):
-    row = None
-    col = None
-    while True:
-        row = random.randrange(0, ROWS)
-        col = random.randrange(0, COLS)
 
-        if f"{row}{col}" not in tiles:
-            break
+def invalidate_frame():
+    global _last_frame
+    _last_frame = None
 
-    return row, col
 
+def draw(window, tiles):
+    # Only the cells whose tile appeared, moved, changed or vanished since the
+    # last frame are repainted and pushed to the display.
+    global _last_frame
+    frame = {(tile.x, tile.y, tile.value) for tile in tiles.values()}
+    if frame == _last_frame:
+        return
+
+    if _last_frame is None:
+        dirty = [window.get_rect()]
+    else:
+        dirty = [pygame.Rect(x, y, RECT_WIDTH, RECT_HEIGHT) for x, y, _ in frame ^ _last_frame]
+
+    for rect in dirty:
+        window.set_clip(rect)
+        window.blit(get_background(), rect, rect)
+        for tile in tiles.values():
+            if rect.colliderect((tile.x, tile.y, RECT_WIDTH, RECT_HEIGHT)):
+                tile.draw(window)
+        window.blit(get_grid_overlay(), rect, rect)
+    window.set_clip(None)
+
+    pygame.display.update(dirty)
+    _last_frame = frame
+
+
+DIRECTIONS = {
+    pygame.K_LEFT: bitboard.LEFT,
+    pygame.K_RIGHT: bitboard.RIGHT,
+    pygame.K_UP: bitboard.UP,
+    pygame.K_DOWN: bitboard.DOWN,
+}
+
+
+class Animation:
+    # Slides tiles from their old to their new cells by elapsed wall time.
+    # The logical board is already final; frames only interpolate positions.
+    def __init__(self, plan, start):
+        self.tiles = {}
+        self.paths = []
+        for from_cell, to_cell, exponent, merged in plan:
+            from_row, from_col = divmod(from_cell, COLS)
+            to_row, to_col = divmod(to_cell, COLS)
+            tile = Tile(1 << exponent, from_row, from_col)
+            self.tiles[from_cell] = tile
+            self.paths.append((tile, tile.x, tile.y, to_col * RECT_WIDTH, to_row * RECT_HEIGHT))
+        self.start = start
+
+    def update(self, now):
+        progress = min(1.0, (now - self.start) / ANIMATION_SECONDS)
+        for tile, from_x, from_y, to_x, to_y in self.paths:
+            tile.x = round(from_x + (to_x - from_x) * progress)
+            tile.y = round(from_y + (to_y - from_y) * progress)
+        return progress >= 1.0
+
+
+def board_tiles(board):
+    tiles = {}
+    for cell in range(ROWS * COLS):
+        exponent = (board >> (bitboard.CELL_BITS * cell)) & bitboard.CELL_MASK
+        if exponent:
+            row, col = divmod(cell, COLS)
+            tiles[cell] = Tile(1 << exponent, row, col)
+    return tiles
 
-def move_tiles(window, tiles, clock, direction):
-    updated = True
-    blocks = set()
-
-    if direction == "left":
-        sort_func = lambda x: x.col
-        reverse = False
-        delta = (-MOVE_VEL, 0)
-        boundary_check = lambda tile: tile.col == 0
-        get_next_tile = lambda tile: tiles.get(f"{tile.row}{tile.col - 1}")
-        merge_check = lambda tile, next_tile: tile.x > next_tile.x + MOVE_VEL
-        move_check = (
-            lambda tile, next_tile: tile.x > next_tile.x + RECT_WIDTH + MOVE_VEL
-        )
-        ceil = True
-    elif direction == "right":
-        sort_func = lambda x: x.col
-        reverse = True
-        delta = (MOVE_VEL, 0)
-        boundary_check = lambda tile: tile.col == COLS - 1
-        get_next_tile = lambda tile: tiles.get(f"{tile.row}{tile.col + 1}")
-        merge_check = lambda tile, next_tile: tile.x < next_tile.x - MOVE_VEL
-        move_check = (
-            lambda tile, next_tile: tile.x + RECT_WIDTH + MOVE_VEL < next_tile.x
-        )
-        ceil = False
-    elif direction == "up":
-        sort_func = lambda x: x.row
-        reverse = False
-        delta = (0, -MOVE_VEL)
-        boundary_check = lambda tile: tile.row == 0
-        get_next_tile = lambda tile: tiles.get(f"{tile.row - 1}{tile.col}")
-        merge_check = lambda tile, next_tile: tile.y > next_tile.y + MOVE_VEL
-        move_check = (
-            lambda tile, next_tile: tile.y > next_tile.y + RECT_HEIGHT + MOVE_VEL
-        )
-        ceil = True
-    elif direction == "down":
-        sort_func = lambda x: x.row
-        reverse = True
-        delta = (0, MOVE_VEL)
-        boundary_check = lambda tile: tile.row == ROWS - 1
-        get_next_tile = lambda tile: tiles.get(f"{tile.row + 1}{tile.col}")
-        merge_check = lambda tile, next_tile: tile.y < next_tile.y - MOVE_VEL
-        move_check = (
-            lambda tile, next_tile: tile.y + RECT_HEIGHT + MOVE_VEL < next_tile.y
-        )
-        ceil = False
-
-    while updated:
-        clock.tick(FPS)
-        updated = False
-        sorted_tiles = sorted(tiles.values(), key=sort_func, reverse=reverse)
-
-        for i, tile in enumerate(sorted_tiles):
-            if boundary_check(tile):
-                continue
-
-            next_tile = get_next_tile(tile)
-            if not next_tile:
-                tile.move(delta)
-            elif (
-                tile.value == next_tile.value
-                and tile not in blocks
-                and next_tile not in blocks
-            ):
-                if merge_check(tile, next_tile):
-                    tile.move(delta)
-                else:
-                    next_tile.value *= 2
-                    sorted_tiles.pop(i)
-                    blocks.add(next_tile)
-            elif move_check(tile, next_tile):
-                tile.move(delta)
-            else:
-                continue
-
-            tile.set_pos(ceil)
-            updated = True
-
-        update_tiles(window, tiles, sorted_tiles)
-
-    return end_move(tiles)
-
-
-def end_move(tiles):
-    if len(tiles) == 16:
-        return "lost"
-
-    row, col = get_random_pos(tiles)
-    tiles[f"{row}{col}"] = Tile(random.choice([2, 4]), row, col)
-    return "continue"
-
-
-def update_tiles(window, tiles, sorted_tiles):
-    tiles.clear()
-    for tile in sorted_tiles:
-        tiles[f"{tile.row}{tile.col}"] = tile
-
-    draw(window, tiles)
 
+def generate_board():
+    board = 0
+    for cell in random.sample(range(ROWS * COLS), 2):
+        board |= 1 << (bitboard.CELL_BITS * cell)
+    return board
 
-def generate_tiles():
-    tiles = {}
-    for _ in range(2):
-        row, col = get_random_pos(tiles)
-        tiles[f"{row}{col}"] = Tile(2, row, col)
 
-    return tiles
+def start_move(board, direction, now):
+    new_board, moved, _, plan = bitboard.move_plan(board, direction)
+    if not moved:
+        return board, None
+    new_board = bitboard.add_new_tile(new_board)
+    return new_board, Animation(plan, now)
 
 
 def main(window):
     clock = pygame.time.Clock()
     run = True
 
-    tiles = generate_tiles()
+    board = generate_board()
+    tiles = board_tiles(board)
+    animation = None
+    pending = collections.deque(maxlen=INPUT_QUEUE_LENGTH)
 
     while run:
         clock.tick(FPS)
@@ -237,15 +231,22 @@ def main(window):
                 run = False
                 break
 
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_LEFT:
-                    move_tiles(window, tiles, clock, "left")
-                if event.key == pygame.K_RIGHT:
-                    move_tiles(window, tiles, clock, "right")
-                if event.key == pygame.K_UP:
-                    move_tiles(window, tiles, clock, "up")
-                if event.key == pygame.K_DOWN:
-                    move_tiles(window, tiles, clock, "down")
+            if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                invalidate_frame()
+
+            if event.type == pygame.KEYDOWN and event.key in DIRECTIONS:
+                pending.append(DIRECTIONS[event.key])
+
+        now = time.perf_counter()
+        if animation is not None and animation.update(now):
+            animation = None
+            tiles = board_tiles(board)
+
+        while animation is None and pending:
+            board, animation = start_move(board, pending.popleft(), now)
+            if animation is not None:
+                animation.update(now)
+                tiles = animation.tiles
 
         draw(window, tiles)
 
@@ -253,4 +254,7 @@ def main(window):
 
 
 if __name__ == "__main__":
-    main(WINDOW)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="2048")
+    parser.add_argument("--headless", action="store_true",
+                        help="run without a real window (SDL dummy video driver)")
+    main(init_display(parser.parse_args().headless))
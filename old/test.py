@@ -1,10 +1,16 @@
-import pygame
-import random
+import argparse
 import math
+import os
+import random
+import sys
+
 import numpy as np
-import copy
+import pygame
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "new"))
 
-pygame.init()
+import bitboard
+import game_ai
 
 FPS = 60
 
@@ -20,14 +26,27 @@ OUTLINE_THICKNESS = 10
 BACKGROUND_COLOR = (205, 192, 180)
 FONT_COLOR = (119, 110, 101)
 
-FONT = pygame.font.SysFont("comicsans", 60, bold=True)
-MOVE_VEL = 20
 
-WINDOW = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("2048")
+FONT = None
+WINDOW = None
+
+
+def init_display(headless=False):
+    # Nothing touches SDL until a front end actually starts.
+    global FONT, WINDOW
+    if WINDOW is None:
+        if headless:
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
+        pygame.init()
+        FONT = pygame.font.SysFont("comicsans", 60, bold=True)
+        WINDOW = pygame.display.set_mode((WIDTH, HEIGHT))
+        pygame.display.set_caption("2048")
+    return WINDOW
 
 
 class Tile:
+    __slots__ = ("value", "row", "col", "x", "y")
+
     COLORS = [
         (237, 229, 218),
         (238, 225, 201),
@@ -65,18 +84,6 @@ class Tile:
             ),
         )
 
-    def set_pos(self, ceil=False):
-        if ceil:
-            self.row = math.ceil(self.y / RECT_HEIGHT)
-            self.col = math.ceil(self.x / RECT_WIDTH)
-        else:
-            self.row = math.floor(self.y / RECT_HEIGHT)
-            self.col = math.floor(self.x / RECT_WIDTH)
-
-    def move(self, delta):
-        self.x += delta[0]
-        self.y += delta[1]
-
 
 def draw_grid(window):
     for row in range(1, ROWS):
@@ -101,171 +108,49 @@ def draw(window, tiles):
     pygame.display.update()
 
 
-def get_random_pos(tiles):
-    row = None
-    col = None
-    while True:
-        row = random.randrange(0, ROWS)
-        col = random.randrange(0, COLS)
-
-        if f"{row}{col}" not in tiles:
-            break
-
-    return row, col
-
-
-def move_tiles(tiles, direction):
-    moved = False
-    score = 0
-    blocks = set()
-
-    if direction == "left":
-        sort_func = lambda x: x.col
-        reverse = False
-        delta = (-MOVE_VEL, 0)
-        boundary_check = lambda tile: tile.col == 0
-        get_next_tile = lambda tile: tiles.get(f"{tile.row}{tile.col - 1}")
-        merge_check = lambda tile, next_tile: tile.x > next_tile.x + MOVE_VEL
-        move_check = (
-            lambda tile, next_tile: tile.x > next_tile.x + RECT_WIDTH + MOVE_VEL
-        )
-        ceil = True
-    elif direction == "right":
-        sort_func = lambda x: x.col
-        reverse = True
-        delta = (MOVE_VEL, 0)
-        boundary_check = lambda tile: tile.col == COLS - 1
-        get_next_tile = lambda tile: tiles.get(f"{tile.row}{tile.col + 1}")
-        merge_check = lambda tile, next_tile: tile.x < next_tile.x - MOVE_VEL
-        move_check = (
-            lambda tile, next_tile: tile.x + RECT_WIDTH + MOVE_VEL < next_tile.x
-        )
-        ceil = False
-    elif direction == "up":
-        sort_func = lambda x: x.row
-        reverse = False
-        delta = (0, -MOVE_VEL)
-        boundary_check = lambda tile: tile.row == 0
-        get_next_tile = lambda tile: tiles.get(f"{tile.row - 1}{tile.col}")
-        merge_check = lambda tile, next_tile: tile.y > next_tile.y + MOVE_VEL
-        move_check = (
-            lambda tile, next_tile: tile.y > next_tile.y + RECT_HEIGHT + MOVE_VEL
-        )
-        ceil = True
-    elif direction == "down":
-        sort_func = lambda x: x.row
-        reverse = True
-        delta = (0, MOVE_VEL)
-        boundary_check = lambda tile: tile.row == ROWS - 1
-        get_next_tile = lambda tile: tiles.get(f"{tile.row + 1}{tile.col}")
-        merge_check = lambda tile, next_tile: tile.y < next_tile.y - MOVE_VEL
-        move_check = (
-            lambda tile, next_tile: tile.y + RECT_HEIGHT + MOVE_VEL < next_tile.y
-        )
-        ceil = False
-
-    sorted_tiles = sorted(tiles.values(), key=sort_func, reverse=reverse)
-
-    for i, tile in enumerate(sorted_tiles):
-        if boundary_check(tile):
-            continue
-
-        next_tile = get_next_tile(tile)
-        if not next_tile:
-            tile.move((delta[0] * RECT_WIDTH, delta[1] * RECT_HEIGHT))
-            moved = True
-        elif tile.value == next_tile.value and tile not in blocks and next_tile not in blocks:
-            if merge_check(tile, next_tile):
-                tile.move((delta[0] * RECT_WIDTH, delta[1] * RECT_HEIGHT))
-            else:
-                next_tile.value *= 2
-                score += next_tile.value
-                sorted_tiles.pop(i)
-                blocks.add(next_tile)
-                moved = True
-        elif move_check(tile, next_tile):
-            tile.move((delta[0] * RECT_WIDTH, delta[1] * RECT_HEIGHT))
-            moved = True
-        else:
-            continue
+DIRECTION_MOVES = {
+    "left": bitboard.move_left,
+    "up": bitboard.move_up,
+    "down": bitboard.move_down,
+    "right": bitboard.move_right,
+}
+AI_DIRECTIONS = ["left", "up", "down", "right"]
 
-        tile.set_pos(ceil)
 
-    update_tiles(tiles, sorted_tiles)
-    return moved, score
-
-
-def end_move(tiles):
-    if len(tiles) == 16:
-        return "lost"
-
-    row, col = get_random_pos(tiles)
-    tiles[f"{row}{col}"] = Tile(random.choice([2, 4]), row, col)
-    return "continue"
-
-
-def update_tiles(tiles, sorted_tiles):
-    tiles.clear()
-    for tile in sorted_tiles:
-        tiles[f"{tile.row}{tile.col}"] = tile
-
-
-def generate_tiles():
+def board_tiles(board):
     tiles = {}
-    for _ in range(2):
-        row, col = get_random_pos(tiles)
-        tiles[f"{row}{col}"] = Tile(2, row, col)
-
+    for index in range(ROWS * COLS):
+        exponent = (board >> (bitboard.CELL_BITS * index)) & bitboard.CELL_MASK
+        if exponent:
+            row, col = divmod(index, COLS)
+            tiles[(row, col)] = Tile(1 << exponent, row, col)
     return tiles
 
 
-def add_random_tile(tiles):
-    row, col = get_random_pos(tiles)
-    tiles[f"{row}{col}"] = Tile(random.choice([2, 4]), row, col)
-
-
-def simulate_move(tiles, direction):
-    new_tiles = copy.deepcopy(tiles)
-    moved, score = move_tiles(new_tiles, direction)
-    if not moved:
-        return tiles, False, 0
-
-    add_random_tile(new_tiles)
-    return new_tiles, True, score
+def generate_board():
+    board = 0
+    for cell in random.sample(range(ROWS * COLS), 2):
+        board |= 1 << (bitboard.CELL_BITS * cell)
+    return board
 
 
-def ai_move(tiles, searches_per_move, search_length):
-    moves = ["left", "right", "up", "down"]
-    scores = {move: 0 for move in moves}
+def move_board(board, direction):
+    new_board, moved, score = DIRECTION_MOVES[direction](board)
+    if moved:
+        new_board = bitboard.add_new_tile(new_board)
+    return new_board, moved, score
 
-    for first_move in moves:
-        simulated_tiles, valid, score = simulate_move(tiles, first_move)
 
-        if not valid:
-            continue
-
-        scores[first_move] += score
-
-        for _ in range(searches_per_move):
-            move_number = 1
-            search_tiles = copy.deepcopy(simulated_tiles)
-            is_valid = True
-
-            while is_valid and move_number <= search_length:
-                next_move = random.choice(moves)
-                search_tiles, is_valid, score = simulate_move(search_tiles, next_move)
-                if is_valid:
-                    scores[first_move] += score
-                    move_number += 1
-
-    best_move = max(scores, key=scores.get)
-    return best_move
+def ai_move(board, searches_per_move, search_length):
+    scores = game_ai.batch_rollout_scores(board, searches_per_move, search_length + 1)
+    return AI_DIRECTIONS[int(np.argmax(game_ai.mask_illegal_moves(board, scores)))]
 
 
 def main(window):
     clock = pygame.time.Clock()
     run = True
-    tiles = generate_tiles()
+    board = generate_board()
+    tiles = board_tiles(board)
 
     while run:
         clock.tick(FPS)
@@ -275,42 +160,26 @@ def main(window):
                 run = False
 
             if event.type == pygame.KEYDOWN:
+                direction = None
                 if event.key == pygame.K_ESCAPE:
                     run = False
 
                 if event.key == pygame.K_LEFT:
-                    moved, score = move_tiles(tiles, "left")
-                    if moved:
-                        add_random_tile(tiles)
-
+                    direction = "left"
                 if event.key == pygame.K_RIGHT:
-                    moved, score = move_tiles(tiles, "right")
-                    if moved:
-                        add_random_tile(tiles)
-
+                    direction = "right"
                 if event.key == pygame.K_UP:
-                    moved, score = move_tiles(tiles, "up")
-                    if moved:
-                        add_random_tile(tiles)
-
+                    direction = "up"
                 if event.key == pygame.K_DOWN:
-                    moved, score = move_tiles(tiles, "down")
-                    if moved:
-                        add_random_tile(tiles)
+                    direction = "down"
 
                 if event.key == pygame.K_SPACE:
-                    best_move = ai_move(tiles, searches_per_move=100, search_length=10)
-                    if best_move == "left":
-                        moved, score = move_tiles(tiles, "left")
-                    elif best_move == "right":
-                        moved, score = move_tiles(tiles, "right")
-                    elif best_move == "up":
-                        moved, score = move_tiles(tiles, "up")
-                    elif best_move == "down":
-                        moved, score = move_tiles(tiles, "down")
+                    direction = ai_move(board, searches_per_move=100, search_length=10)
 
+                if direction is not None:
+                    board, moved, score = move_board(board, direction)
                     if moved:
-                        add_random_tile(tiles)
+                        tiles = board_tiles(board)
 
         draw(window, tiles)
 
@@ -318,4 +187,7 @@ def main(window):
 
 
 if __name__ == "__main__":
-    main(WINDOW)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="2048")
+    parser.add_argument("--headless", action="store_true",
+                        help="run without a real window (SDL dummy video driver)")
+    main(init_display(parser.parse_args().headless))
@@ -0,0 +1,133 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "new"))
+
+import bitboard
+import game_functions
+from game_functions import merge_elements, push_board_right
+
+# The original NumPy engine: rotate so the move points right, push, merge,
+# push again and rotate back. push_board_right and merge_elements are kept in
+# game_functions as this reference.
+ROTATIONS = {bitboard.LEFT: 2, bitboard.UP: -1, bitboard.DOWN: 1, bitboard.RIGHT: 0}
+
+
+def reference_move(board, direction):
+    turns = ROTATIONS[direction]
+    rotated = np.rot90(board, turns)
+    pushed, has_pushed = push_board_right(rotated)
+    merged, has_merged, score = merge_elements(pushed)
+    pushed_again, _ = push_board_right(merged)
+    return np.rot90(pushed_again, -turns), has_pushed or has_merged, score
+
+
+def random_boards(count, seed=0):
+    rng = np.random.default_rng(seed)
+    exponents = rng.choice([0, 0, 0, 1, 1, 2, 3, 4, 7, 11], size=(count, 4, 4))
+    return np.where(exponents > 0, np.left_shift(1, exponents), 0)
+
+
+def test_moves_match_reference_engine():
+    for board in random_boards(2000):
+        packed = bitboard.pack_board(board)
+        for direction in range(4):
+            expected, expected_moved, expected_score = reference_move(board, direction)
+            new_packed, moved, score = bitboard.MOVES[direction](packed)
+            assert np.array_equal(bitboard.unpack_board(new_packed), expected)
+            assert moved == expected_moved
+            assert score == expected_score
+
+
+def test_batch_moves_match_scalar_moves():
+    boards = random_boards(500, seed=1)
+    packed = bitboard.pack_boards(boards)
+    directions = np.arange(len(packed)) % 4
+    new_boards, moved, scores = bitboard.move_boards(packed, directions)
+    for index, (board, direction) in enumerate(zip(packed, directions)):
+        expected = bitboard.MOVES[direction](int(board))
+        assert (int(new_boards[index]), bool(moved[index]), int(scores[index])) == expected
+
+
+def test_pack_round_trip():
+    boards = random_boards(100, seed=2)
+    assert np.array_equal(bitboard.unpack_boards(bitboard.pack_boards(boards)), boards)
+
+
+def test_pack_rejects_tiles_that_do_not_fit():
+    board = np.zeros((4, 4), dtype=int)
+    board[0, 0] = 1 << 16
+    with pytest.raises(ValueError):
+        bitboard.pack_board(board)
+    with pytest.raises(ValueError):
+        bitboard.pack_boards(board[None])
+
+
+def test_pack_rejects_other_shapes():
+    with pytest.raises(ValueError):
+        bitboard.pack_board(np.zeros((5, 5), dtype=int))
+
+
+def test_add_new_tile_leaves_full_board_unchanged():
+    full = 0x1111111111111111
+    assert bitboard.add_new_tile(full) == full
+    assert int(bitboard.add_new_tiles(np.array([full], dtype=np.uint64))[0]) == full
+
+
+def test_numpy_add_new_tile_leaves_full_boards_unchanged():
+    for shape in ((4, 4), (5, 5)):
+        full = np.full(shape, 2)
+        assert np.array_equal(game_functions.add_new_tile(full.copy()), full)
+
+
+def test_numpy_add_new_tile_fills_one_empty_cell():
+    board = np.zeros((4, 4), dtype=int)
+    board[0, 0] = 8
+    spawned = game_functions.add_new_tile(board.copy())
+    assert spawned[0, 0] == 8
+    assert np.count_nonzero(spawned) == 2
+    assert set(spawned.ravel()) - {0, 8} <= {2, 4}
+
+
+def test_symmetries_match_apply_symmetry_and_numpy():
+    for board in random_boards(50, seed=3):
+        packed = bitboard.pack_board(board)
+        images = bitboard.symmetries(packed)
+        assert [bitboard.apply_symmetry(packed, t) for t in range(8)] == list(images)
+        expected = {bitboard.pack_board(np.rot90(flipped, turns))
+                    for flipped in (board, board.T) for turns in range(4)}
+        assert set(images) == expected
+
+
+def test_canonical_is_the_transformed_board():
+    for board in random_boards(200, seed=4):
+        packed = bitboard.pack_board(board)
+        canonical, transform = bitboard.canonical(packed)
+        assert bitboard.apply_symmetry(packed, transform) == canonical
+        assert canonical == min(bitboard.symmetries(packed))
+
+
+def test_symmetry_moves_commute_with_transforms():
+    # Includes the canonical transform, which the transposition table keys on.
+    for board in random_boards(200, seed=5):
+        packed = bitboard.pack_board(board)
+        for transform in range(8):
+            image = bitboard.apply_symmetry(packed, transform)
+            for move_index in range(4):
+                new_board, moved, score = bitboard.MOVES[move_index](packed)
+                symmetric_move = bitboard.SYMMETRY_MOVES[transform][move_index]
+                expected = (bitboard.apply_symmetry(new_board, transform), moved, score)
+                assert bitboard.MOVES[symmetric_move](image) == expected
+                assert bitboard.INVERSE_SYMMETRY_MOVES[transform][symmetric_move] == move_index
+
+
+def test_batch_symmetries_match_scalar():
+    packed = bitboard.pack_boards(random_boards(300, seed=6))
+    images = bitboard.symmetric_boards(packed)
+    canonical, transforms = bitboard.canonical_boards(packed)
+    for index, board in enumerate(packed):
+        assert tuple(int(image) for image in images[index]) == bitboard.symmetries(int(board))
+        assert (int(canonical[index]), int(transforms[index])) == bitboard.canonical(int(board))
@@ -0,0 +1,102 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "new"))
+
+import bitboard
+import board_engine
+from random_stream import RandomStream
+
+SHAPES = [(2, 2), (3, 3), (4, 4), (5, 5), (8, 8), (2, 7), (6, 3)]
+
+
+def reference_slide(line):
+    # Slides one line of exponents towards index 0, merging each pair once.
+    tiles = [exponent for exponent in line if exponent]
+    slid = []
+    score = 0
+    while tiles:
+        if len(tiles) > 1 and tiles[0] == tiles[1]:
+            slid.append(tiles[0] + 1)
+            score += 1 << (tiles[0] + 1)
+            tiles = tiles[2:]
+        else:
+            slid.append(tiles.pop(0))
+    return slid + [0] * (len(line) - len(slid)), score
+
+
+def reference_move(board, direction):
+    # Orients the board so the move slides rows towards column 0.
+    oriented = {board_engine.LEFT: board, board_engine.RIGHT: board[:, ::-1],
+                board_engine.UP: board.T, board_engine.DOWN: board.T[:, ::-1]}[direction]
+    slid = np.empty_like(oriented)
+    score = 0
+    for index, line in enumerate(oriented):
+        slid[index], line_score = reference_slide([int(exponent) for exponent in line])
+        score += line_score
+    new_board = {board_engine.LEFT: slid, board_engine.RIGHT: slid[:, ::-1],
+                 board_engine.UP: slid.T, board_engine.DOWN: slid[:, ::-1].T}[direction]
+    return new_board, bool((new_board != board).any()), score
+
+
+def random_boards(shape, count, seed=0, high_exponents=False):
+    # high_exponents mixes in 14s and 15s, which the table path cannot hold.
+    rng = np.random.default_rng(seed)
+    choices = [0, 0, 0, 1, 1, 2, 3, 5] + ([14, 15, 15] if high_exponents else [])
+    return rng.choice(choices, size=(count,) + shape).astype(np.uint8)
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+@pytest.mark.parametrize("high_exponents", [False, True])
+def test_moves_match_reference(shape, high_exponents):
+    engine = board_engine.engine(*shape)
+    boards = random_boards(shape, 300, high_exponents=high_exponents)
+    for direction in range(4):
+        new_boards, moved, scores = engine.move_boards(boards, direction)
+        for index, board in enumerate(boards):
+            expected, expected_moved, expected_score = reference_move(board, direction)
+            assert np.array_equal(new_boards[index], expected)
+            assert moved[index] == expected_moved
+            assert scores[index] == expected_score
+            new_board, single_moved, single_score = engine.move(board, direction)
+            assert np.array_equal(new_board, expected)
+            assert (single_moved, single_score) == (expected_moved, expected_score)
+
+
+def test_exponent_15_lines_merge():
+    engine = board_engine.engine(2, 5)
+    board = np.array([[15, 15, 0, 1, 1], [0, 0, 0, 0, 0]], dtype=np.uint8)
+    new_board, moved, score = engine.move(board, board_engine.LEFT)
+    assert new_board[0].tolist() == [16, 2, 0, 0, 0]
+    assert moved
+    assert score == (1 << 16) + (1 << 2)
+
+
+def test_4x4_matches_bitboard():
+    engine = board_engine.engine(4, 4)
+    boards = random_boards((4, 4), 500, seed=1)
+    packed = bitboard.pack_boards(board_engine.tiles_of(boards))
+    directions = np.arange(len(boards)) % 4
+    new_boards, moved, scores = engine.move_boards(boards, directions)
+    packed_boards, packed_moved, packed_scores = bitboard.move_boards(packed, directions)
+    assert np.array_equal(board_engine.tiles_of(new_boards), bitboard.unpack_boards(packed_boards))
+    assert np.array_equal(moved, packed_moved)
+    assert np.array_equal(scores, packed_scores)
+    assert np.array_equal(engine.legal_move_masks(boards), bitboard.legal_move_masks(packed))
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_add_new_tiles_fills_one_empty_cell(shape):
+    engine = board_engine.engine(*shape)
+    boards = random_boards(shape, 200, seed=2)
+    boards[0] = 1
+    spawned = engine.add_new_tiles(boards, RandomStream(0))
+    changed = spawned != boards
+    assert np.array_equal(spawned[0], boards[0])
+    room = (boards == 0).any(axis=(1, 2))
+    assert np.array_equal(changed.sum(axis=(1, 2)), room.astype(int))
+    assert np.all(boards[changed] == 0)
+    assert set(spawned[changed].tolist()) <= {1, 2}
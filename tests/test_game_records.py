@@ -0,0 +1,88 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "new"))
+
+import bitboard
+import game_records
+from random_stream import RandomStream
+
+
+def play_random_game(seed, max_moves=60):
+    # Returns every (board, move, moved_board, spawned_board, score) played
+    # and the final board.
+    rng = RandomStream(seed)
+    board = bitboard.new_packed_game(rng)
+    transitions = []
+    for _ in range(max_moves):
+        options = bitboard.LEGAL_MOVE_LISTS[bitboard.legal_moves(board)]
+        if not options:
+            break
+        move = options[rng.below(len(options))]
+        moved_board, _, score = bitboard.MOVES[move](board)
+        spawned_board = bitboard.add_new_tile(moved_board, rng)
+        transitions.append((board, move, moved_board, spawned_board, score))
+        board = spawned_board
+    return transitions, board
+
+
+def steps_of(transitions):
+    return np.array([game_records.make_step(*transition) for transition in transitions],
+                    dtype=game_records.STEP_DTYPE)
+
+
+def test_round_trip_across_reopen(tmp_path):
+    path = str(tmp_path / "games.rec")
+    games = [play_random_game(seed) for seed in range(4)]
+    with game_records.GameRecordWriter(path) as writer:
+        for seed in range(2):
+            transitions, final_board = games[seed]
+            writer.begin_game(seed)
+            for transition in transitions:
+                writer.add_step(*transition)
+            writer.end_game(final_board)
+    with game_records.GameRecordWriter(path) as writer:
+        for seed in range(2, 4):
+            transitions, final_board = games[seed]
+            writer.write_game(seed, steps_of(transitions), final_board)
+
+    reader = game_records.GameRecordReader(path)
+    assert len(reader) == len(games)
+    assert reader.position_count == sum(len(transitions) for transitions, _ in games)
+    for index, (transitions, final_board) in enumerate(games):
+        boards = [transition[0] for transition in transitions]
+        game, stored_steps = reader.game(index)
+        assert int(game["seed"]) == index
+        assert int(game["score"]) == sum(transition[4] for transition in transitions)
+        assert int(game["final_board"]) == final_board
+        assert stored_steps["board"].tolist() == boards
+        assert reader.replay(index) == boards + [final_board]
+        assert reader.game_of(int(game["first_step"])) == index
+
+
+def test_reader_drops_steps_past_the_last_game(tmp_path):
+    path = str(tmp_path / "games.rec")
+    transitions, final_board = play_random_game(0)
+    steps = steps_of(transitions)
+    with game_records.GameRecordWriter(path) as writer:
+        writer.write_game(0, steps, final_board)
+    # An interrupted write leaves steps on disk that no index entry covers.
+    with open(path, "ab") as data:
+        data.write(steps[:5].tobytes())
+
+    reader = game_records.GameRecordReader(path)
+    assert len(reader) == 1
+    assert reader.position_count == len(steps)
+    assert reader.replay(0) == steps["board"].tolist() + [final_board]
+
+    # A writer reopening the file appends after the leftovers, and the new
+    # game's index entry points at its own steps.
+    more_transitions, more_final = play_random_game(1)
+    more_steps = steps_of(more_transitions)
+    with game_records.GameRecordWriter(path) as writer:
+        writer.write_game(1, more_steps, more_final)
+    reader = game_records.GameRecordReader(path)
+    assert reader.replay(1)[-1] == more_final
+    assert reader.replay(1)[:-1] == more_steps["board"].tolist()